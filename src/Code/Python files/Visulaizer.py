@@ -32,10 +32,10 @@ def read_csv(file):
 		if attrs[i].lower() == 'latitude':
 			break
 		i += 1
-	j = 0
+	x_list = []
+	y_list = []
 	matplot.figure("Map", (30, 10))
 	matplot.title('Map')
-	j = 0
 	for line in file:
 		if line == '\n' or line.strip() == '':
 			continue
@@ -45,25 +45,24 @@ def read_csv(file):
 		# 	point.append(line[ind]))
 		data_points.append(line)
 		if line[i] != '' and line[i + 1] != '':
-			matplot.plot(float(line[i]), float(line[i + 1]), 'b^')
-			# print(float(line[i]), float(line[i + 1]))
-		print(j)
-		j += 1
-	print('ready')
+			x_list.append(float(line[i]))
+			y_list.append(float(line[i + 1]))
+	print('ready', len(data_points))
+	matplot.plot(x_list, y_list, 'b^')
 	matplot.show()
 	return attrs, data_points
 
 
 def draw_map(data, idx):
-	# x_list = []
-	# y_list = []
+	x_list = []
+	y_list = []
 	for point in data:
-		# x_list.append(point[idx])
-		# y_list.append(point[idx + 1])
 		if point[idx] != '' and point[idx + 1] != '':
-			matplot.plot(float(point[idx]), float(point[idx + 1]))
+			x_list.append(float(point[idx]))
+			y_list.append(float(point[idx + 1]))
 	matplot.figure("Map", (30, 10))
 	matplot.title('Map')
+	matplot.plot(x_list, y_list, 'b^')
 	matplot.show()
 
 
@@ -0,0 +1,73 @@
+"""
+Counts the collisions of every group the plots need in a single pass. Each collision is given one integer key made of
+its day, hour, borough and class, and a single bincount over the keys gives the count of every combination. Every
+other table is a sum over some of its axes.
+"""
+import numpy as np
+
+N_DAYS = 7
+N_HOURS = 24
+N_BOROUGHS = 5
+N_CLASSES = 3
+SOUTH, NORTH = 40.4774, 40.9176
+WEST, EAST = -74.2591, -73.7004
+
+
+def group_key(day, hour, borough, safety_class):
+	"""
+	Combines the day, hour, borough and class of every collision into a single integer.
+	:param day: The array of days.
+	:param hour: The array of hours.
+	:param borough: The array of boroughs.
+	:param safety_class: The array of classes.
+	:return: The array of keys.
+	"""
+	key = day.astype(np.intp) * N_HOURS + hour
+	key = key * N_BOROUGHS + borough
+	return key * N_CLASSES + safety_class
+
+
+def count(key, weights=None):
+	"""
+	Counts the collisions of every day, hour, borough and class.
+	:param key: The array of keys made by group_key.
+	:param weights: Add up these values instead of counting. Default value is None.
+	:return: The counts as an array of shape (days, hours, boroughs, classes).
+	"""
+	counts = np.bincount(key, weights, minlength=N_DAYS * N_HOURS * N_BOROUGHS * N_CLASSES)
+	if weights is None or np.issubdtype(np.asarray(weights).dtype, np.integer):
+		counts = counts.astype(np.int64)
+	return counts.reshape(N_DAYS, N_HOURS, N_BOROUGHS, N_CLASSES)
+
+
+def find_sums(data):
+	"""
+	Finds the total number of people and the number of pedestrians that were injured and killed.
+	:param data: The data as IncidentColumns.
+	:return: The number of people injured and killed, and the number of pedestrians injured and killed.
+	"""
+	return int(data.injured.sum(dtype=np.int64)), int(data.killed.sum(dtype=np.int64)),\
+		   int(data.pedestrian_injured.sum(dtype=np.int64)), int(data.pedestrian_killed.sum(dtype=np.int64))
+
+
+class Aggregates:
+	"""
+	Stores the count of collisions for every day, hour, borough and class, and the tables drawn from them.
+	"""
+	__slots__ = 'counts', 'sums'
+
+	def __init__(self, data):
+		self.counts = count(group_key(data.day, data.time_class, data.borough, data.safety_class))
+		self.sums = find_sums(data)
+
+	def borough_class(self):
+		return self.counts.sum(axis=(0, 1))
+
+	def hour_class(self):
+		return self.counts.sum(axis=(0, 2))
+
+	def hour_borough(self):
+		return self.counts.sum(axis=(0, 3))
+
+	def day_class(self):
+		return self.counts.sum(axis=(1, 2))
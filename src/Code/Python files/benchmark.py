@@ -0,0 +1,220 @@
+"""
+Times every stage of build_features.py and classifier.py on synthetic collision files of several sizes and writes
+the results as json, so that the speed of two versions of the code can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import numpy as np
+import build_features
+import classifier
+import instrument
+
+SCALES = [10000]
+STAGES = ['read', 'write', 'stream', 'aggregate', 'plot', 'load_csv', 'load_cache', 'knn', 'random_forest']
+TRAIN_ROWS = 100000
+HEXBIN_ROWS = 200000
+GENERATE_CHUNK = 100000
+TRACE_MEMORY = False
+HEADER = '"DATE","BOROUGH","ZIP.CODE","LATITUDE","LONGITUDE","PERSONS.INJURED","PERSONS.KILLED","VEHICLE.1.TYPE",' \
+		 '"VEHICLE.2.TYPE","VEHICLE.1.FACTOR","VEHICLE.2.FACTOR","VEHICLE.3.FACTOR","VEHICLE.4.FACTOR",' \
+		 '"VEHICLE.5.FACTOR","day","month","hour","Classify"\n'
+DAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+CLASSES = ['SAFE', 'INJURED', 'KILLED']
+VEHICLES = ['PASSENGER VEHICLE', 'SPORT UTILITY/STATION WAGON', 'TAXI', 'OTHER', 'VAN', 'UNKNOWN', 'BUS', '']
+FACTORS = ['UNSPECIFIED', 'DRIVER INATTENTION/DISTRACTION', 'OTHER VEHICULAR', 'FATIGUED/DROWSY',
+		   'FAILURE TO YIELD RIGHT-OF-WAY', 'BACKING UNSAFELY', 'PAVEMENT SLIPPERY', '']
+
+
+def generate(file_name, rows, seed=0):
+	"""
+	Writes a synthetic collisions file in the format of clean.csv, which has no ID or pedestrian columns, in date order.
+	:param file_name: The name of the file.
+	:param rows: The number of collisions.
+	:param seed: The random seed.
+	:return: None.
+	"""
+	random = np.random.default_rng(seed)
+	with open(file_name, 'w') as file:
+		file.write(HEADER)
+		for start in range(0, rows, GENERATE_CHUNK):
+			n = min(GENERATE_CHUNK, rows - start)
+			dates = np.datetime64('2015-01-01') + (start + np.arange(n)) * 730 // rows
+			days = (dates.astype(np.int64) + 3) % 7
+			months = dates.astype('datetime64[M]').astype(np.int64) % 12
+			hours = random.integers(0, 24, n)
+			boroughs = random.integers(0, len(build_features.BOROUGHS), n)
+			zip_codes = random.integers(10001, 11698, n)
+			latitudes = np.round(random.uniform(40.5, 40.9, n), 7)
+			longitudes = np.round(random.uniform(-74.25, -73.7, n), 7)
+			injured = random.choice([0, 0, 0, 1, 2], n)
+			killed = (random.random(n) < .01).astype(int)
+			classes = np.where(killed > 0, 2, np.where(injured > 0, 1, 0))
+			vehicles = random.integers(0, len(VEHICLES), (n, 2))
+			factors = random.integers(0, len(FACTORS), (n, 5))
+			factors[:, 2:] = np.where(random.random((n, 3)) < .9, len(FACTORS) - 1, factors[:, 2:])
+			lines = []
+			for i in range(n):
+				lines.append('%s,"%s",%d,%s,%s,%d,%d,%s,"%s","%s","%s",%d,"%s"\n'
+							 % (dates[i], build_features.BOROUGHS[boroughs[i]], zip_codes[i], latitudes[i],
+								longitudes[i], injured[i], killed[i],
+								','.join('"' + VEHICLES[vehicle] + '"' for vehicle in vehicles[i]),
+								'","'.join(FACTORS[factor] for factor in factors[i]), DAYS[days[i]],
+								MONTHS[months[i]], hours[i], CLASSES[classes[i]]))
+			file.write(''.join(lines))
+
+
+def measure(stage, rows, function, *args):
+	"""
+	Runs a stage and records it with the instrument module.
+	:param stage: The name of the stage.
+	:param rows: The number of rows processed.
+	:param function: The function that runs the stage.
+	:param args: The arguments of the function.
+	:return: The result of the function.
+	"""
+	with instrument.stage(stage, rows):
+		result = function(*args)
+	print(stage, rows, round(instrument.RECORDER.records[-1]['wall_seconds'], 3), 's')
+	return result
+
+
+def read(file_name):
+	"""
+	Reads a collisions file into columns.
+	"""
+	file = build_features.file_check(file_name, 'r')
+	attrs, data = build_features.read_columns(file)
+	file.close()
+	return attrs, data
+
+
+def write(file_name, attrs, data):
+	"""
+	Writes the classified file and its binary cache, as build_features.py does.
+	"""
+	file = build_features.file_check(file_name, 'w')
+	build_features.write_columns(attrs, data, file)
+	file.close()
+	build_features.write_cache(file_name, attrs, data)
+
+
+def stream(file_in, file_out):
+	"""
+	Builds the classified file in streaming mode.
+	"""
+	with open(file_in) as source, open(file_out, 'w') as target:
+		build_features.stream_file(build_features.ATTRS, source, target)
+
+
+def plot(data):
+	"""
+	Draws the map of all collisions and the three histograms.
+	"""
+	build_features.draw_map(data, hexbin=len(data) > HEXBIN_ROWS)
+	counts = build_features.aggregate_data(data)
+	build_features.draw_hist(None, counts=counts)
+	build_features.draw_time_hist(None, counts)
+	build_features.draw_time_hist_borough(None, counts)
+
+
+def load_csv(file_name):
+	"""
+	Parses the classified file the way classifier.py does without a cache.
+	"""
+	file = build_features.file_check(file_name, 'r')
+	result = classifier.read_csv(file)
+	file.close()
+	return result
+
+
+def run(rows, directory, stages=STAGES, train_rows=TRAIN_ROWS):
+	"""
+	Times the stages on a synthetic file.
+	:param rows: The number of collisions in the file.
+	:param directory: The directory for the files.
+	:param stages: The names of the stages to time.
+	:param train_rows: The largest number of rows used by the classifier stages.
+	:return: The list of records.
+	"""
+	raw = os.path.join(directory, 'clean_%d.csv' % rows)
+	classified = os.path.join(directory, 'clean_%d_classified.csv' % rows)
+	if not os.path.exists(raw):
+		generate(raw, rows)
+	build_features.set_output(directory)
+	recorder = instrument.enable(trace_memory=TRACE_MEMORY)
+	attrs, data = measure('read', rows, read, raw)
+	if any(stage in stages for stage in ['write', 'load_csv', 'load_cache', 'knn', 'random_forest']):
+		measure('write', rows, write, classified, attrs, data)
+	if 'stream' in stages:
+		measure('stream', rows, stream, raw, classified + '.stream')
+	if 'aggregate' in stages:
+		measure('aggregate', rows, build_features.aggregate_data, data)
+	if 'plot' in stages:
+		measure('plot', rows, plot, data)
+	del data
+	if 'load_csv' in stages:
+		measure('load_csv', rows, load_csv, classified)
+	if any(stage in stages for stage in ['load_cache', 'knn', 'random_forest']):
+		attrs, points, classes = measure('load_cache', rows, classifier.load_data, classified)
+		points = np.asarray(points[:train_rows])
+		classes = np.asarray(classes[:train_rows])
+		split = classifier.train_test_split(points, classes)
+		if 'knn' in stages:
+			measure('knn', len(points), classifier.knn_sweep, *split)
+		if 'random_forest' in stages:
+			measure('random_forest', len(points), classifier.forest_sweep, *split)
+	return [dict(record, rows_scale=rows) for record in recorder.records if record['stage'] in stages]
+
+
+def version():
+	"""
+	Finds the version of the code and of the libraries being timed.
+	:return: A dictionary of versions.
+	"""
+	try:
+		commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+								cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+	except OSError:
+		commit = ''
+	return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+			'machine': platform.machine(), 'cpus': os.cpu_count()}
+
+
+def parse_args():
+	"""
+	Parses the command line arguments.
+	:return: The arguments.
+	"""
+	parser = argparse.ArgumentParser(description='Times the stages of the feature build and the classifiers.')
+	parser.add_argument('--rows', nargs='+', type=int, default=SCALES,
+						help='The sizes of the synthetic files, e.g. 10000 1000000 10000000.')
+	parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+	parser.add_argument('--train-rows', type=int, default=TRAIN_ROWS,
+						help='The largest number of rows used by the classifier stages.')
+	parser.add_argument('--dir', default='bench', help='The directory for the synthetic files.')
+	parser.add_argument('--output', default='benchmark.json', help='The file to write the results to.')
+	parser.add_argument('--trace-memory', action='store_true',
+						help='Record the peak memory allocated by every stage. Slows the stages down.')
+	return parser.parse_args()
+
+
+def main():
+	global TRACE_MEMORY
+	args = parse_args()
+	TRACE_MEMORY = args.trace_memory
+	os.makedirs(args.dir, exist_ok=True)
+	results = {'version': version(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'trace_memory': TRACE_MEMORY,
+			   'records': []}
+	for rows in args.rows:
+		results['records'] += run(rows, args.dir, args.stages, args.train_rows)
+	with open(args.output, 'w') as file:
+		json.dump(results, file, indent=1)
+	print('written', args.output)
+
+if __name__ == '__main__':
+	main()
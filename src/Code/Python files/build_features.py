@@ -6,7 +6,19 @@ Date: Dec 4th, 2017.
 from matplotlib import pyplot as plt
 import numpy as np
 from matplotlib import ticker as tick
-import datetime as dt
+import argparse
+from collections import Counter
+import multiprocessing as mp
+import os
+import aggregate
+import clean
+import instrument
+from cube import CountCube, cube_path
+import dataset_cache
+import csv_parser
+import fileio
+import shared_data
+from parsing import find_day, find_time, find_ordinal, format_date
 
 CLASSES = ['Safe', 'Injured', 'Killed']
 DAYS = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY']
@@ -16,6 +28,15 @@ COLORS = ['lightgreen', 'cornflowerblue', 'magenta']
 # BOROUGH_COLORS = ['lightgreen', 'cornflowerblue', 'goldenrod', 'salmon', 'olive']
 # BOROUGH_COLORS = ['r', 'y', 'g', 'b', 'k']
 BOROUGH_COLORS = ['mediumslateblue', 'k', 'gold', 'fuchsia', 'dimgrey']
+ATTRS = 'ID,DATE,TIME,BOROUGH,LATITUDE,LONGITUDE,CLASS'
+CHUNK_SIZE = 100000
+WRITTEN = ['id', 'day', 'time_class', 'borough', 'latitude', 'longitude', 'safety_class']
+SHARD_BYTES = 64 * 1024 * 1024
+OUTPUT_DIR = None
+HEX_GRID = 200
+KINDS = {'borough': BOROUGHS.index, 'latitude': 'float', 'longitude': 'float'}
+COLUMNS = [csv_parser.Column(column.name, column.aliases, KINDS.get(column.name, column.kind), column.default)
+		   for column in clean.INCIDENT_COLUMNS]
 
 
 class Incident:
@@ -26,29 +47,25 @@ class Incident:
 				'pedestrian_injured', 'pedestrian_killed', 'safety_class'
 
 	def __init__(self, point):
-		self.id = int(point[1])
-		self.date = point[2]
+		self.id = int(point['id'])
+		self.date = point['date']
 		self.day = self.find_day()
-		self.time = point[3]
+		self.time = point['time']
 		self.time_class = self.find_time()
-		self.borough = BOROUGHS.index(point[4])
-		self.latitude = float(point[6])
-		self.longitude = float(point[7])
-		self.injured = int(point[13])
-		self.killed = int(point[14])
-		self.pedestrian_injured = int(point[15])
-		self.pedestrian_killed = int(point[16])
+		self.borough = BOROUGHS.index(point['borough'])
+		self.latitude = float(point['latitude'])
+		self.longitude = float(point['longitude'])
+		self.injured = int(point['injured'])
+		self.killed = int(point['killed'])
+		self.pedestrian_injured = int(point['pedestrian_injured'])
+		self.pedestrian_killed = int(point['pedestrian_killed'])
 		self.safety_class = self.find_safety()
 
 	def find_day(self):
-		if '/' in self.date:
-			day = dt.datetime.strptime(self.date, '%m/%d/%Y').date().weekday()
-		else:
-			day = dt.datetime.strptime(self.date, '%m-%d-%y').date().weekday()
-		return day
+		return find_day(self.date)
 
 	def find_time(self):
-		return int(self.time.split(':')[0])
+		return find_time(self.time)
 
 	def find_safety(self):
 		if self.killed > 0:
@@ -63,6 +80,84 @@ class Incident:
 			   str(self.latitude) + ',' + str(self.longitude) + ',' + str(self.safety_class)
 
 
+class IncidentColumns:
+	"""
+	Stores the details of many collisions as typed NumPy columns, one array per attribute, built from the fields read
+	by csv_parser.Parser.chunks with the COLUMNS. Dates are stored as
+	proleptic Gregorian ordinals, which makes the day of the week (ordinal - 1) % 7.
+	Iterating over it yields Incident views so it can be used wherever a list of Incidents is expected.
+	"""
+	__slots__ = 'id', 'date', 'day', 'time_class', 'borough', 'latitude', 'longitude', 'injured', 'killed',\
+				'pedestrian_injured', 'pedestrian_killed', 'safety_class'
+
+	TYPES = {'id': np.int32, 'date': np.int32, 'day': np.uint8, 'time_class': np.uint8, 'borough': np.uint8,
+			 'latitude': np.float64, 'longitude': np.float64, 'injured': np.int16, 'killed': np.int16,
+			 'pedestrian_injured': np.int16, 'pedestrian_killed': np.int16, 'safety_class': np.uint8}
+
+	def __init__(self, fields):
+		self.id = fields['id'].astype(np.int32)
+		self.date = fields['date'].astype(np.int32)
+		self.day = ((self.date - 1) % 7).astype(np.uint8)
+		self.time_class = fields['time'].astype(np.uint8)
+		self.borough = fields['borough'].astype(np.uint8)
+		self.latitude = fields['latitude'].astype(np.float64)
+		self.longitude = fields['longitude'].astype(np.float64)
+		self.injured = fields['injured'].astype(np.int16)
+		self.killed = fields['killed'].astype(np.int16)
+		self.pedestrian_injured = fields['pedestrian_injured'].astype(np.int16)
+		self.pedestrian_killed = fields['pedestrian_killed'].astype(np.int16)
+		self.safety_class = self.find_safety()
+
+	@classmethod
+	def from_arrays(cls, **arrays):
+		"""
+		Builds the columns directly from already typed arrays.
+		:param arrays: One array for each of the attributes in __slots__.
+		:return: The columns.
+		"""
+		columns = cls.__new__(cls)
+		for name in cls.__slots__:
+			setattr(columns, name, np.asarray(arrays[name], cls.TYPES[name]))
+		return columns
+
+	def find_safety(self):
+		return np.where(self.killed > 0, 2, np.where(self.injured > 0, 1, 0)).astype(np.uint8)
+
+	def select(self, mask):
+		"""
+		Selects a subset of the collisions.
+		:param mask: A boolean mask or an array of row indices.
+		:return: The selected collisions as columns.
+		"""
+		return IncidentColumns.from_arrays(**{name: getattr(self, name)[mask] for name in self.__slots__})
+
+	def __len__(self):
+		return len(self.id)
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			raise TypeError('IncidentColumns are indexed by row, use select for a slice')
+		return self.view(*[getattr(self, name)[i].item() for name in self.__slots__])
+
+	def __iter__(self):
+		rows = zip(*[getattr(self, name).tolist() for name in self.__slots__])
+		return (self.view(*row) for row in rows)
+
+	def view(self, *row):
+		"""
+		Builds an Incident from one row of the columns without re-parsing it. Only the hour of the time is kept, so the
+		time is given on the hour.
+		:param row: The values of the row in the order of __slots__.
+		:return: The Incident.
+		"""
+		incident = Incident.__new__(Incident)
+		for name, value in zip(self.__slots__, row):
+			setattr(incident, name, value)
+		incident.date = format_date(incident.date)
+		incident.time = '%02d:00' % incident.time_class
+		return incident
+
+
 def file_check(file, permission):
 	"""
     Creates a file handler.
@@ -78,73 +173,149 @@ def file_check(file, permission):
 		exit()
 
 
-def read_csv(file):
+def read_csv(file, quarantine=None):
 	"""
 	Reads the csv file and converts it into data points and attriutes.
     :param file: File handler
+    :param quarantine: The csv_parser.Quarantine to put unreadable rows in. Default value is None.
     :return: list of attributes and a list of data points.
     """
 	attrs = 'ID,DATE,TIME,BOROUGH,LATITUDE,LONGITUDE,CLASS'
 	data_points = []
-	# j = 0
-	# matplot.figure("Map", (30, 10))
-	# matplot.title('Map')
-	# j = 0
-	file.readline()
-	for line in file:
-		if line == '\n' or line.strip() == '':
-			continue
-		line = line.strip().split(',')
-		for i in range(len(line)):
-			line[i] = line[i].strip('"')
-		data_points.append(Incident(line))
+	parser = csv_parser.Parser(file, COLUMNS, quarantine=quarantine)
+	for row, point in parser.rows():
+		try:
+			data_points.append(Incident(point))
+		except ValueError:
+			parser.quarantine.add(row, 'bad row', point.values())
 	return attrs, data_points
 
 
-def draw_map(data, name='ALL'):
+def empty_columns():
+	"""
+	Builds IncidentColumns without any collision.
+	:return: The columns.
+	"""
+	return IncidentColumns.from_arrays(**{name: [] for name in IncidentColumns.__slots__})
+
+
+def read_columns(file, quarantine=None, chunk_size=CHUNK_SIZE):
+	"""
+	Reads the csv file in bulk into typed columns instead of building an Incident for every row. The rows are held as
+	strings one chunk at a time, and only the typed columns of every chunk are kept.
+	:param file: File handler
+	:param quarantine: The csv_parser.Quarantine to put unreadable rows in. Default value is None.
+	:param chunk_size: The maximum number of rows held as strings at a time.
+	:return: list of attributes and the data points as IncidentColumns.
+	"""
+	return ATTRS, concat_columns(list(read_chunks(file, chunk_size, quarantine)))
+
+
+def read_chunks(file, chunk_size=CHUNK_SIZE, quarantine=None):
+	"""
+	Lazily reads the csv file as a sequence of chunks so that only one chunk is held in memory at a time.
+	:param file: File handler
+	:param chunk_size: The maximum number of data points in a chunk.
+	:param quarantine: The csv_parser.Quarantine to put unreadable rows in. Default value is None.
+	:return: A generator of IncidentColumns.
+	"""
+	for fields in csv_parser.Parser(file, COLUMNS, quarantine=quarantine).chunks(chunk_size):
+		yield IncidentColumns(fields)
+
+
+def read_raw(file, chunk_size=CHUNK_SIZE, quarantine=None, filtered=None):
+	"""
+	Lazily reads the raw collision export, cleaning it on the way with clean.py, so that no clean.csv is needed.
+	:param file: File handler
+	:param chunk_size: The maximum number of data points in a chunk.
+	:param quarantine: The csv_parser.Quarantine to put unreadable rows in. Default value is None.
+	:param filtered: The Counter of the collisions dropped for having no location or borough. Default value is None.
+	:return: A generator of IncidentColumns.
+	"""
+	for fields in clean.read_chunks(file, chunk_size, quarantine, filtered):
+		yield IncidentColumns(fields)
+
+
+def concat_columns(chunks):
+	"""
+	Joins chunks of collisions into one.
+	:param chunks: The list of IncidentColumns.
+	:return: The IncidentColumns of all the chunks.
+	"""
+	if len(chunks) == 0:
+		return empty_columns()
+	return IncidentColumns.from_arrays(**{name: np.concatenate([getattr(chunk, name) for chunk in chunks])
+										  for name in IncidentColumns.__slots__})
+
+
+def set_output(directory):
+	"""
+	Switches to the non-interactive Agg backend so that every figure is written to a directory instead of being shown.
+	:param directory: The directory to write the figures to.
+	:return: None.
+	"""
+	global OUTPUT_DIR
+	plt.switch_backend('Agg')
+	os.makedirs(directory, exist_ok=True)
+	OUTPUT_DIR = directory
+
+
+def show(name):
+	"""
+	Shows the current figure, or writes it to OUTPUT_DIR as name.png and closes every open figure if set_output was
+	called.
+	:param name: The name of the figure.
+	:return: None.
+	"""
+	if OUTPUT_DIR is None:
+		plt.show()
+		return
+	plt.savefig(os.path.join(OUTPUT_DIR, name.replace(' ', '_') + '.png'))
+	plt.close('all')
+
+
+def to_columns(data):
+	"""
+	Converts a list of Incidents to IncidentColumns. IncidentColumns are returned as they are.
+	:param data: The data.
+	:return: The data as IncidentColumns.
+	"""
+	if isinstance(data, IncidentColumns):
+		return data
+	arrays = {name: np.fromiter([getattr(incident, name) for incident in data], IncidentColumns.TYPES[name], len(data))
+			  for name in IncidentColumns.__slots__ if name != 'date'}
+	arrays['date'] = np.fromiter([find_ordinal(incident.date) for incident in data], np.int32, len(data))
+	return IncidentColumns.from_arrays(**arrays)
+
+
+def draw_map(data, name='ALL', hexbin=False):
 	"""
-	Draws a map of the data points based on the latitude and longitude of each collision.
+	Draws a map of the data points based on the latitude and longitude of each collision, with one plot for each
+	class.
 	:param data: The data.
 	:param name: The name of the map. Default value is 'ALL'
+	:param hexbin: Draw the density of the collisions on a hexagonal grid instead of every point, for data with
+	millions of points. Default value is False.
 	:return: None.
 	"""
-	class2 = False
-	class1 = False
-	class0 = False
+	data = to_columns(data)
 	plt.figure(name, (20, 20))
 	plt.title(name)
-	minx = float('inf')
-	maxx = -float('inf')
-	miny = float('inf')
-	maxy = -float('inf')
-	for incident in data:
-		x = incident.longitude
-		if x < minx:
-			minx = x
-		elif x > maxx:
-			maxx = x
-		y = incident.latitude
-		if y < miny:
-			miny = y
-		elif y > maxy:
-			maxy = y
-		safety_class = incident.safety_class
-		if not class2 and safety_class == 2 and class1:
-			plt.plot(x, y, MARKERS[safety_class], label=CLASSES[safety_class])
-			class2 = True
-		elif not class1 and safety_class == 1 and class0:
-			plt.plot(x, y, MARKERS[safety_class], label=CLASSES[safety_class])
-			class1 = True
-		elif not class0 and safety_class == 0:
-			plt.plot(x, y, MARKERS[safety_class], label=CLASSES[safety_class])
-			class0 = True
-		else:
-			plt.plot(x, y, MARKERS[safety_class])
-	plt.plot(minx, miny, '')
-	plt.plot(maxx, maxy, '')
+	if hexbin:
+		plt.hexbin(data.longitude, data.latitude, gridsize=HEX_GRID, bins='log', mincnt=1)
+		plt.colorbar(label='COUNT')
+	else:
+		for safety_class in range(len(CLASSES)):
+			mask = data.safety_class == safety_class
+			if mask.any():
+				plt.plot(data.longitude[mask], data.latitude[mask], MARKERS[safety_class],
+						 label=CLASSES[safety_class])
+		if len(data) > 0:
+			plt.plot([data.longitude.min(), data.longitude.max()], [data.latitude.min(), data.latitude.max()],
+					 linestyle='none')
+			plt.legend(loc='upper right')
 	plt.gca().set_aspect('equal', adjustable='box')
-	plt.legend(loc='upper right')
-	plt.show()
+	show(name)
 
 
 def split_by_day(data):
@@ -153,6 +324,8 @@ def split_by_day(data):
 	:param data: The data.
 	:return: A list of data for collisions that occur on each day.
 	"""
+	if isinstance(data, IncidentColumns):
+		return [data.select(data.day == day) for day in range(7)]
 	day_data = [[] for _ in range(7)]
 	for incident in data:
 		day_data[incident.day].append(incident)
@@ -165,6 +338,8 @@ def split_by_borough(data):
 	:param data: The data.
 	:return: A list of data for collisions that occur in each borough.
 	"""
+	if isinstance(data, IncidentColumns):
+		return [data.select(data.borough == borough) for borough in range(len(BOROUGHS))]
 	borough_data = [[] for _ in range(len(BOROUGHS))]
 	for incident in data:
 		borough_data[incident.borough].append(incident)
@@ -177,6 +352,8 @@ def split_by_time(data):
 	:param data: The data.
 	:return: A list of data for collisions that occur at each hour of the day it occurred on.
 	"""
+	if isinstance(data, IncidentColumns):
+		return [data.select(data.time_class == time) for time in range(24)]
 	time_data = [[] for _ in range(24)]
 	for incident in data:
 		time_data[incident.time_class].append(incident)
@@ -206,41 +383,20 @@ def draw_boroughs(data):
 		draw_map(boroughs[borough], BOROUGHS[borough])
 
 
-def draw_hist(data, name='ALL'):
+def draw_hist(data, name='ALL', counts=None):
 	"""
 	Draws a histogram of the count of collisions based on the borough they occur in and the type of incident they
 	result in.
-	:param data: The data
+	:param data: The data. Not used if counts is given.
 	:param name: The name off the histogram.
+	:param counts: The Aggregates of the data if already computed. Default value is None.
 	:return: None.
 	"""
-	data = split_by_borough(data)
+	if counts is None:
+		counts = aggregate_data(data)
 	plt.figure('Histogram', (40, 30))
-	# bars = []
 	x = np.arange(len(BOROUGHS))
-	zero_list = []
-	one_list = []
-	two_list = []
-	for b in range(len(data)):
-		zero = 0
-		one = 0
-		two = 0
-		for incident in data[b]:
-			if incident.safety_class == 0:
-				zero += 1
-			elif incident.safety_class == 1:
-				one += 1
-			else:
-				two += 1
-		# bars += [zero, one, two, 0]
-		zero_list.append(zero)
-		one_list.append(one)
-		two_list.append(two)
-	# matplot.hist(bars, bins=len(bars))#, color=COLORS, label=CLASSES)
-	# xt = []
-	# for b in BOROUGHS:
-	# 	xt += ['', b, '', '']
-	y_list = [zero_list, one_list, two_list]
+	y_list = counts.borough_class().T
 	f, a = plt.subplots()# 40, 30)
 	a.set_title(name)
 	a.grid(zorder=0)
@@ -255,43 +411,22 @@ def draw_hist(data, name='ALL'):
 	a.set_xlabel('BOROUGHS')
 	a.set_ylabel('COUNT')
 	a.legend(CLASSES)#, 'upper right')
-	plt.show()
+	show('HISTOGRAM_' + name)
 
 
-def draw_time_hist(data):
+def draw_time_hist(data, counts=None):
 	"""
 	Draws a histogram of the count of collisions based on the hour in the day and the type of incident they
 	result in.
-	:param data: The data
+	:param data: The data. Not used if counts is given.
+	:param counts: The Aggregates of the data if already computed. Default value is None.
 	:return: None.
 	"""
-	data = split_by_time(data)
+	if counts is None:
+		counts = aggregate_data(data)
 	plt.figure('Time based Histogram', (40, 30))
-	# bars = []
 	x = np.arange(24)
-	zero_list = []
-	one_list = []
-	two_list = []
-	for t in range(len(data)):
-		zero = 0
-		one = 0
-		two = 0
-		for incident in data[t]:
-			if incident.safety_class == 0:
-				zero += 1
-			elif incident.safety_class == 1:
-				one += 1
-			else:
-				two += 1
-		# bars += [zero, one, two, 0]
-		zero_list.append(zero)
-		one_list.append(one)
-		two_list.append(two)
-	# matplot.hist(bars, bins=len(bars))#, color=COLORS, label=CLASSES)
-	# xt = []
-	# for b in BOROUGHS:
-	# 	xt += ['', b, '', '']
-	y_list = [zero_list, one_list, two_list]
+	y_list = counts.hour_class().T
 	f, a = plt.subplots()  # 40, 30)
 	a.set_title('Time Based Histogram')
 	a.grid(zorder=0)
@@ -306,53 +441,21 @@ def draw_time_hist(data):
 	a.set_xlabel('HOUR')
 	a.set_ylabel('COUNT')
 	a.legend(CLASSES)  # , 'upper right')
-	plt.show()
+	show('TIME_HISTOGRAM')
 
 
-def draw_time_hist_borough(data):
+def draw_time_hist_borough(data, counts=None):
 	"""
 	Draws a histogram of the count of collisions based on the hour in the day and the borough they occur in.
-	:param data: The data
+	:param data: The data. Not used if counts is given.
+	:param counts: The Aggregates of the data if already computed. Default value is None.
 	:return: None.
 	"""
-	data = split_by_time(data)
+	if counts is None:
+		counts = aggregate_data(data)
 	plt.figure('Time based Histogram', (40, 30))
-	# bars = []
 	x = np.arange(24)
-	man_list = []
-	bronx_list = []
-	queens_list = []
-	brook_list = []
-	staten_list = []
-	for t in range(len(data)):
-		man = 0
-		bronx = 0
-		queens = 0
-		brook = 0
-		staten = 0
-		# BOROUGHS = ['MANHATTAN', 'BRONX', 'QUEENS', 'BROOKLYN', 'STATEN ISLAND']
-		for incident in data[t]:
-			if incident.borough == 0:
-				man += 1
-			elif incident.borough == 1:
-				bronx += 1
-			elif incident.borough == 2:
-				queens += 1
-			elif incident.borough == 3:
-				brook += 1
-			else:
-				staten += 1
-		# bars += [zero, one, two, 0]
-		man_list.append(man)
-		bronx_list.append(bronx)
-		queens_list.append(queens)
-		brook_list.append(brook)
-		staten_list.append(staten)
-	# matplot.hist(bars, bins=len(bars))#, color=COLORS, label=CLASSES)
-	# xt = []
-	# for b in BOROUGHS:
-	# 	xt += ['', b, '', '']
-	y_list = [man_list,	bronx_list, queens_list, brook_list, staten_list]
+	y_list = counts.hour_borough().T
 	f, a = plt.subplots()  # 40, 30)
 	a.set_title('Time Based Histogram')
 	a.grid(zorder=0)
@@ -367,7 +470,7 @@ def draw_time_hist_borough(data):
 	a.set_xlabel('HOUR')
 	a.set_ylabel('COUNT')
 	a.legend(BOROUGHS)  # , 'upper right')
-	plt.show()
+	show('TIME_HISTOGRAM_BOROUGH')
 
 #
 # def draw_time_hist_day(data):
@@ -431,22 +534,97 @@ def draw_time_hist_borough(data):
 # 	plt.show()
 
 
+def plot_tasks(data, hexbin=False):
+	"""
+	Lists every figure drawn from the data. The figures are independent of each other.
+	:param data: The data.
+	:param hexbin: Draw the maps as hexagonal density grids. Default value is False.
+	:return: A list of (function, rows, arguments) tasks, the rows of the data drawn being None for none, 'ALL' for
+	all of them, or a (column, value) pair.
+	"""
+	counts = aggregate_data(data)
+	tasks = [(draw_map, ('borough', borough), (BOROUGHS[borough], hexbin)) for borough in range(len(BOROUGHS))]
+	tasks.append((draw_map, 'ALL', ('ALL', hexbin)))
+	tasks += [(draw_map, ('day', day), (DAYS[day], hexbin)) for day in range(len(DAYS))]
+	tasks += [(draw_hist, None, ('ALL', counts)), (draw_time_hist, None, (counts,)),
+			  (draw_time_hist_borough, None, (counts,))]
+	return tasks
+
+
+_render_data = None
+
+
+def init_render(directory, descriptor=None, data=None):
+	"""
+	Prepares a process for drawing: the figures are written to the directory, and the data is either attached from
+	shared memory or given.
+	:param directory: The directory to write the figures to.
+	:param descriptor: The descriptor of the shared_data.SharedDataset of the columns. Default value is None.
+	:param data: The data when it is not shared. Default value is None.
+	:return: None.
+	"""
+	global _render_data
+	set_output(directory)
+	if descriptor is not None:
+		data = IncidentColumns.from_arrays(**shared_data.attach(descriptor).arrays)
+	_render_data = data
+
+
+def draw_task(task):
+	"""
+	Draws a single figure. Runs in a worker process when rendering concurrently.
+	:param task: The (function, rows, arguments) task.
+	:return: None.
+	"""
+	function, rows, args = task
+	if rows is None:
+		data = None
+	elif rows == 'ALL':
+		data = _render_data
+	else:
+		column, value = rows
+		data = _render_data.select(getattr(_render_data, column) == value)
+	function(data, *args)
+
+
+def render_all(data, directory, workers=1, hexbin=False):
+	"""
+	Writes every figure to a directory without showing any window, drawing them in worker processes if asked to. The
+	workers read the data from shared memory instead of each receiving its own copy of the rows they draw.
+	:param data: The data.
+	:param directory: The directory to write the figures to.
+	:param workers: The number of worker processes. Default value is 1, i.e. draw in this process.
+	:param hexbin: Draw the maps as hexagonal density grids. Default value is False.
+	:return: None.
+	"""
+	data = to_columns(data)
+	tasks = plot_tasks(data, hexbin)
+	if workers > 1:
+		with shared_data.share({name: getattr(data, name) for name in IncidentColumns.__slots__}) as shared:
+			with mp.Pool(workers, initializer=init_render, initargs=(directory, shared.descriptor)) as pool:
+				pool.map(draw_task, tasks, chunksize=1)
+	else:
+		init_render(directory, data=data)
+		for task in tasks:
+			draw_task(task)
+
+
+def aggregate_data(data):
+	"""
+	Counts the collisions of every day, hour, borough and class, and the people injured and killed, in a single pass.
+	:param data: The data.
+	:return: The Aggregates of the data.
+	"""
+	return aggregate.Aggregates(to_columns(data))
+
+
 def find_sums(data):
 	"""
 	Finds the total number of people and the number of pedestrians that were injured and killed.
 	:param data: The data.
 	:return: The number of people injured and killed, and the number of pedestrians injured and killed.
 	"""
-	ped_kill = 0
-	ped_inj = 0
-	kill = 0
-	inj = 0
-	for d in data:
-		ped_kill += d.pedestrian_killed
-		ped_inj += d.pedestrian_injured
-		kill += d.killed
-		inj += d.injured
-	return inj, kill, ped_inj, ped_kill
+	return aggregate.find_sums(to_columns(data))
 
 
 def write_file(attrs, data, file):
@@ -462,20 +640,272 @@ def write_file(attrs, data, file):
 		file.write(str(incident) + '\n')
 
 
+def format_rows(data):
+	"""
+	Formats a chunk of the data as the lines written by write_file, converting each column at once rather than each
+	Incident.
+	:param data: The data as IncidentColumns.
+	:return: The lines as a single string.
+	"""
+	if len(data) == 0:
+		return ''
+	columns = [map(str, getattr(data, name).tolist()) for name in WRITTEN]
+	return '\n'.join(map(','.join, zip(*columns))) + '\n'
+
+
+def write_columns(attrs, data, file, chunk_size=CHUNK_SIZE):
+	"""
+	Writes the built data into a file in large chunks. Produces the same file as write_file.
+	:param attrs: A list of the features.
+	:param data: The data as IncidentColumns.
+	:param file: The file.
+	:param chunk_size: The number of rows formatted at a time.
+	:return: None.
+	"""
+	file.write(attrs.strip(',') + '\n')
+	for start in range(0, len(data), chunk_size):
+		file.write(format_rows(data.select(slice(start, start + chunk_size))))
+
+
+def write_cache(file_name, attrs, data):
+	"""
+	Writes the binary cache that classifier.py loads instead of parsing the written file.
+	:param file_name: The name of the written file.
+	:param attrs: A list of the features.
+	:param data: The data as IncidentColumns.
+	:return: None.
+	"""
+	points = np.column_stack([data.day, data.time_class, data.borough, data.latitude, data.longitude])
+	dataset_cache.write_cache(file_name, attrs.strip(',').split(',')[1:], points, data.safety_class)
+	dataset_cache.write_dates(file_name, data.date)
+
+
+def stream_file(attrs, file_in, file_out, chunk_size=CHUNK_SIZE, quarantine=None, filtered=None, dates=None):
+	"""
+	Reads, classifies and writes the data one chunk at a time, producing the same file as write_file.
+	:param attrs: A list of the features.
+	:param file_in: The file to read.
+	:param file_out: The file to write.
+	:param chunk_size: The maximum number of data points held in memory.
+	:param quarantine: The csv_parser.Quarantine to put unreadable rows in. Default value is None.
+	:param filtered: The Counter of the dropped collisions when file_in is the raw export, or None if it is clean.
+	Default value is None.
+	:param dates: The list to append the dates of the written rows to, chunk by chunk. Default value is None.
+	:return: The CountCube of the data.
+	"""
+	file_out.write(attrs.strip(',') + '\n')
+	cube = CountCube()
+	chunks = read_chunks(file_in, chunk_size, quarantine) if filtered is None else \
+		read_raw(file_in, chunk_size, quarantine, filtered)
+	for chunk in chunks:
+		file_out.write(format_rows(chunk))
+		cube.update(chunk)
+		if dates is not None:
+			dates.append(chunk.date)
+	return cube
+
+
+def find_shards(file_name, shards):
+	"""
+	Splits the data rows of a file into byte ranges that start and end on line boundaries. Quoted fields spanning
+	several lines are not supported.
+	:param file_name: The name of the file.
+	:param shards: The number of ranges wanted.
+	:return: A list of (file name, header, number of rows before the range, start, end) byte ranges in file order.
+	"""
+	with open(file_name, 'rb') as file:
+		header = file.readline().decode()
+		start = file.tell()
+		size = os.fstat(file.fileno()).st_size
+		bounds = [start]
+		for i in range(1, shards):
+			offset = start + (size - start) * i // shards
+			if offset <= bounds[-1]:
+				continue
+			file.seek(offset - 1)
+			file.readline()
+			if file.tell() < size:
+				bounds.append(file.tell())
+		bounds.append(size)
+		file.seek(start)
+		rows = [0]
+		for i in range(len(bounds) - 1):
+			rows.append(rows[-1] + file.read(bounds[i + 1] - bounds[i]).count(b'\n'))
+	return [(file_name, header, rows[i], bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)
+			if bounds[i] < bounds[i + 1]]
+
+
+def read_range(file_name, start, end):
+	"""
+	Lazily reads the lines of a byte range of a file, so that the range is never held in memory at once.
+	:param file_name: The name of the file.
+	:param start: The offset of the first line.
+	:param end: The offset just past the last line.
+	:return: A generator of the decoded lines.
+	"""
+	with open(file_name, 'rb') as file:
+		file.seek(start)
+		while start < end:
+			line = file.readline()
+			if not line:
+				break
+			start += len(line)
+			yield line.decode()
+
+
+def build_shard(shard):
+	"""
+	Classifies the rows of a single byte range of the file. Runs in a worker process.
+	:param shard: The (file name, header, number of rows before the range, start, end) byte range.
+	:return: The written rows of the range, their CountCube, their dates and the csv_parser.Quarantine of the range.
+	"""
+	file_name, header, first_row, start, end = shard
+	quarantine = csv_parser.Quarantine()
+	parser = csv_parser.Parser(read_range(file_name, start, end), COLUMNS, header, first_row, quarantine)
+	chunk = concat_columns([IncidentColumns(fields) for fields in parser.chunks(CHUNK_SIZE)])
+	return format_rows(chunk), CountCube.from_data(chunk), chunk.date, quarantine
+
+
+def parallel_file(attrs, file_name, file_out, workers, quarantine=None, dates=None):
+	"""
+	Classifies the data in a pool of worker processes, one byte range of the file at a time, and writes the
+	results in the original row order. Produces the same file as write_file.
+	:param attrs: A list of the features.
+	:param file_name: The name of the file to read.
+	:param file_out: The file to write.
+	:param workers: The number of worker processes.
+	:param quarantine: The csv_parser.Quarantine to put unreadable rows in. Default value is None.
+	:param dates: The list to append the dates of the written rows to, shard by shard. Default value is None.
+	:return: The CountCube of the data.
+	"""
+	shards = find_shards(file_name, max(workers * 4, os.path.getsize(file_name) // SHARD_BYTES + 1))
+	file_out.write(attrs.strip(',') + '\n')
+	cube = CountCube()
+	with mp.Pool(workers) as pool:
+		for text, part, part_dates, rejected in pool.imap(build_shard, shards):
+			file_out.write(text)
+			cube.add(part)
+			if dates is not None:
+				dates.append(part_dates)
+			if quarantine is not None:
+				quarantine.merge(rejected)
+	return cube
+
+
+def report(recorder):
+	"""
+	Prints the timings of the stages if they were recorded.
+	:param recorder: The instrument.Recorder, or None.
+	:return: None.
+	"""
+	if recorder is not None:
+		print(recorder.report())
+
+
+def report_quarantine(quarantine, file_name=None, filtered=None):
+	"""
+	Prints how many rows could not be read or were dropped and why, and writes the first unreadable ones to a file if
+	asked to.
+	:param quarantine: The csv_parser.Quarantine.
+	:param file_name: The file to write the rows to. Default value is None.
+	:param filtered: The Counter of the dropped collisions. Default value is None.
+	:return: None.
+	"""
+	if filtered:
+		print('dropped', ', '.join(str(count) + ' ' + reason for reason, count in sorted(filtered.items())))
+	if quarantine.total() > 0:
+		print(quarantine)
+	if file_name is not None:
+		quarantine.write(file_name)
+
+
+def parse_args():
+	"""
+	Parses the command line arguments.
+	:return: The arguments.
+	"""
+	parser = argparse.ArgumentParser(description='Builds the features of the collisions and plots them.')
+	parser.add_argument('--input', default='clean.csv', help='The cleaned collisions file, decompressed if it ends in .gz or .zst.')
+	parser.add_argument('--raw', action='store_true',
+						help='The input is the raw export; clean it on the way instead of reading clean.csv.')
+	parser.add_argument('--output', default='clean_classified.csv',
+						help='The file to write the features to, compressed if it ends in .gz or .zst.')
+	parser.add_argument('--stream', action='store_true',
+						help='Stream the data in chunks in constant memory. Nothing is plotted in this mode.')
+	parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+						help='The number of rows held in memory at a time when streaming.')
+	parser.add_argument('--workers', type=int, default=1,
+						help='Build the features in this many processes. Nothing is plotted when more than 1.')
+	parser.add_argument('--out-dir', help='Write every figure to this directory instead of showing it.')
+	parser.add_argument('--render-workers', type=int, default=1,
+						help='The number of processes drawing figures when writing them to --out-dir.')
+	parser.add_argument('--hexbin', action='store_true', help='Draw the maps as hexagonal density grids.')
+	parser.add_argument('--quarantine', metavar='FILE', help='Write the first rows that could not be read to this file.')
+	instrument.add_arguments(parser)
+	args = parser.parse_args()
+	if args.raw and args.workers > 1:
+		parser.error('--raw reads the export in a single process, --workers cannot be used with it')
+	if args.workers > 1 and args.input.endswith(('.gz', '.zst')):
+		parser.error('--workers splits the input at byte offsets, it cannot be used with a compressed input')
+	return args
+
+
 def main():
-	file_in = file_check('clean.csv', 'r')
-	file_out = file_check('clean_classified.csv', 'w')
-	attrs, data_points = read_csv(file_in)
+	args = parse_args()
+	recorder = instrument.enable_from(args)
+	quarantine = csv_parser.Quarantine()
+	filtered = Counter() if args.raw else None
+	file_in = file_check(args.input, 'r') if args.workers > 1 else fileio.open_file(args.input, 'r')
+	file_out = fileio.open_file(args.output, 'w')
+	if args.workers > 1 or args.stream:
+		dates = []
+		with instrument.stage('build') as stage:
+			if args.workers > 1:
+				file_in.close()
+				cube = parallel_file(ATTRS, args.input, file_out, args.workers, quarantine, dates)
+			else:
+				cube = stream_file(ATTRS, file_in, file_out, args.chunk_size, quarantine, filtered, dates)
+			file_out.close()
+			stage.rows = cube.counts()
+		dataset_cache.write_dates(args.output, np.concatenate(dates) if dates else np.zeros(0, np.int32))
+		with instrument.stage('cube'):
+			cube.save(cube_path(args.output))
+		print('written')
+		print(cube.sums())
+		report_quarantine(quarantine, args.quarantine, filtered)
+		report(recorder)
+		return
+	with instrument.stage('read') as stage:
+		if args.raw:
+			attrs, data_points = ATTRS, concat_columns(list(read_raw(file_in, args.chunk_size, quarantine, filtered)))
+		else:
+			attrs, data_points = read_columns(file_in, quarantine)
+		stage.rows = len(data_points)
 	print('read')
-	write_file(attrs, data_points, file_out)
+	report_quarantine(quarantine, args.quarantine, filtered)
+	with instrument.stage('write', len(data_points)):
+		write_columns(attrs, data_points, file_out)
+		file_out.close()
+	with instrument.stage('cache', len(data_points)):
+		write_cache(args.output, attrs, data_points)
+	with instrument.stage('cube', len(data_points)):
+		CountCube.from_data(data_points).save(cube_path(args.output))
 	print('written')
-	print(find_sums(data_points))
+	with instrument.stage('aggregate', len(data_points)):
+		counts = aggregate_data(data_points)
+	print(counts.sums)
+	if args.out_dir is not None:
+		with instrument.stage('plot', len(data_points)):
+			render_all(data_points, args.out_dir, args.render_workers, args.hexbin)
+		report(recorder)
+		return
 	draw_boroughs(data_points)
-	draw_map(data_points)
+	draw_map(data_points, hexbin=args.hexbin)
 	draw_days(data_points)
-	draw_hist(data_points)
-	draw_time_hist(data_points)
-	draw_time_hist_borough(data_points)
+	draw_hist(data_points, counts=counts)
+	draw_time_hist(data_points, counts)
+	draw_time_hist_borough(data_points, counts)
+	report(recorder)
 
 if __name__ == '__main__':
 	# print(list(CLASSES + ['']) * len(BOROUGHS))
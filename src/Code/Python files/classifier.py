@@ -3,14 +3,32 @@ Authors: Ruzan Sasuri(rps7183)
 		 Anuj Chheda(akc9782)
 Date: Dec 4th, 2017.
 """
-from sklearn.neighbors import KNeighborsClassifier
+from sklearn.neighbors import NearestNeighbors
 from sklearn.ensemble import RandomForestClassifier
 import numpy as np
+from scipy import sparse
 from matplotlib import pyplot as plt
+import argparse
+import csv_parser
+import dataset_cache
+import feature_store
+import fileio
+import instrument
+import model
 
 ATTRIBUTES = ['ID', 'DATE', 'TIME', 'BOROUGH', 'LATITUDE', 'LONGITUDE', 'CLASS']
 SPLIT = .7
 COLORS = ['b', 'r', 'k', 'c', 'm', 'y', 'g']
+K_LIST = [k for k in range(1, 101) if k % 3 != 0]
+QUERY_CHUNK = 10000
+N_TREES = 100
+RANDOM_STATE = 0
+COLUMNS = [csv_parser.Column('day', ['DATE'], 'int'),
+		   csv_parser.Column('time', [], 'int'),
+		   csv_parser.Column('borough', [], 'int'),
+		   csv_parser.Column('latitude', [], 'float'),
+		   csv_parser.Column('longitude', [], 'float'),
+		   csv_parser.Column('class', [], 'int')]
 
 
 def file_check(file, permission):
@@ -34,19 +52,54 @@ def read_csv(file):
     :param file: File handler
     :return: list of attributes, list of data points and list of classes.
     """
-	attrs = file.readline().strip().split(',')[1:]
-	for i in range(len(attrs)):
-		attrs[i] = attrs[i].strip()
+	parser = csv_parser.Parser(file, COLUMNS)
+	attrs = parser.header[1:]
 	data_points = []
 	classes = []
-	for line in file:
-		if line == '\n' or line.strip() == '':
-			continue
-		line = line.strip().split(',')[1:]
-		point = [int(line[0]), int(line[1]), int(line[2]), float(line[3]), float(line[4])]
-		data_points.append(point)
-		classes.append(int(line[-1]))
-	return attrs, np.array(data_points), np.array(classes)
+	for fields in parser.chunks(csv_parser.CHUNK_SIZE):
+		data_points.append(np.column_stack([fields[column.name] for column in COLUMNS[:-1]]))
+		classes.append(fields['class'])
+	if parser.quarantine.total() > 0:
+		print(parser.quarantine)
+	if not data_points:
+		return attrs, np.array([]), np.array([])
+	return attrs, np.concatenate(data_points), np.concatenate(classes)
+
+
+def load_data(file_name):
+	"""
+	Loads the classified data from its binary cache, falling back to the csv file and rebuilding the cache when the
+	cache is missing or stale.
+	:param file_name: Name of the csv file.
+	:return: list of attributes, list of data points and list of classes.
+	"""
+	cached = dataset_cache.read_cache(file_name)
+	if cached is not None:
+		return cached
+	file = fileio.open_file(file_name, 'r')
+	attrs, data, classes = read_csv(file)
+	file.close()
+	dataset_cache.write_cache(file_name, attrs, data, classes)
+	return attrs, data, classes
+
+
+def add_categorical(data, file_name, source, encoding='codes', groups=tuple(feature_store.GROUPS)):
+	"""
+	Adds the categorical columns of the feature store to the data, matching the rows by collision ID.
+	:param data: The data.
+	:param file_name: The name of the classified csv file the data was read from.
+	:param source: The name of the cleaned csv file the store is built from if it is missing or stale.
+	:param encoding: 'codes' to add one column of codes per categorical column, or 'one_hot' to add a sparse one-hot
+	block per group. Default value is 'codes'.
+	:param groups: The names of the groups of feature_store.GROUPS to add. Default value is all of them.
+	:return: The data with the new columns, a scipy.sparse CSR matrix for 'one_hot'.
+	"""
+	store, missing = feature_store.load_store(file_name, source).align(feature_store.read_row_ids(file_name))
+	if missing > 0:
+		print(missing, 'rows have no categorical features in', source)
+	if encoding == 'one_hot':
+		return sparse.hstack([sparse.csr_matrix(data), store.one_hot(groups)], format='csr')
+	return np.column_stack([data, store.arrays(groups)])
 
 
 def train_test_split(data, classes):
@@ -56,7 +109,7 @@ def train_test_split(data, classes):
 	:param classes: A list of classes.
 	:return: Lists of the training data, testing data, training classes and testing classes.
 	"""
-	split_row = int(len(data) * SPLIT)
+	split_row = int(data.shape[0] * SPLIT)
 	train_data = data[:split_row]
 	test_data = data[split_row:]
 	train_class = classes[:split_row]
@@ -84,6 +137,32 @@ def classify(train_data, test_data, train_class, test_class, classifier):
 	return accuracy
 
 
+def knn_sweep(train_data, test_data, train_class, test_class, k_list=K_LIST):
+	"""
+	Finds the accuracy of kNN for every k at once. The largest k neighbours of each test point are searched for only
+	once, and the vote of every smaller k is read off the running count of the neighbours' classes. Ties are broken
+	in favour of the smallest class, as KNeighborsClassifier does. When several training points are as far as the k-th
+	neighbour, which of them are counted is arbitrary, and KNeighborsClassifier(n_neighbors=k) may pick others than
+	this single search does, so the accuracy of a few k can differ from a refit by a test point or two.
+	:param train_data: The training data.
+	:param test_data: The testing data.
+	:param train_class: The list of training classes.
+	:param test_class: The list of testing classes.
+	:param k_list: The list of k values.
+	:return: The list of accuracies for each k value.
+	"""
+	labels, train_codes = np.unique(train_class, return_inverse=True)
+	search = NearestNeighbors(n_neighbors=max(k_list)).fit(train_data)
+	columns = np.array(k_list) - 1
+	correct = np.zeros(len(k_list), dtype=np.int64)
+	for start in range(0, test_data.shape[0], QUERY_CHUNK):
+		neighbours = search.kneighbors(test_data[start:start + QUERY_CHUNK], return_distance=False)
+		votes = np.cumsum(train_codes[neighbours][:, :, None] == np.arange(len(labels)), axis=1, dtype=np.int32)
+		y_pred = labels[votes[:, columns].argmax(axis=2)]
+		correct += np.count_nonzero(y_pred == np.asarray(test_class[start:start + QUERY_CHUNK])[:, None], axis=0)
+	return (correct / test_data.shape[0]).tolist()
+
+
 def knn(train_data, test_data, train_class, test_class):
 	"""
 	Uses sklearn's KNeighborsClassifier in sklearn. We run it for k values from 1 to 100 that are not multiples of 3 to avoid
@@ -94,36 +173,60 @@ def knn(train_data, test_data, train_class, test_class):
 	:param test_class: The list of testing classes.
 	:return: The lis of accuracies for each k value.
 	"""
+	accuracy = knn_sweep(train_data, test_data, train_class, test_class, K_LIST)
+	draw_graph(K_LIST, accuracy, 'kNN', special_point=(10, accuracy[6]), xt=[i for i in range(1, 101, 3)])
+	return accuracy
+
+
+def forest_sweep(train_data, test_data, train_class, test_class, n_trees=N_TREES, n_jobs=None,
+				 random_state=RANDOM_STATE):
+	"""
+	Finds the accuracy of a random forest for every number of trees from 1 to n_trees with a single forest. The trees
+	are trained once and their votes on the test data are added up one tree at a time, so the accuracy after n trees
+	is that of a forest of the first n trees, i.e. of RandomForestClassifier(n_estimators=n) with the same seed.
+	:param train_data: The training data.
+	:param test_data: The testing data.
+	:param train_class: The list of training classes.
+	:param test_class: The list of testing classes.
+	:param n_trees: The largest number of trees.
+	:param n_jobs: The number of trees trained in parallel. Default value is None, i.e. 1.
+	:param random_state: The seed of the forest, so that the curve can be reproduced.
+	:return: The list of accuracies for each number of trees.
+	"""
+	rfc = RandomForestClassifier(n_estimators=n_trees, n_jobs=n_jobs, random_state=random_state)
+	rfc.fit(train_data, train_class)
+	test_data = test_data.astype(np.float32) if sparse.issparse(test_data) else np.asarray(test_data, dtype=np.float32)
+	test_class = np.asarray(test_class)
+	votes = np.zeros((test_data.shape[0], len(rfc.classes_)))
 	accuracy = []
-	k_list = []
-	for k in range(1, 101):
-		if k % 3 == 0:
-			continue
-		k_list.append(k)
-		knn = KNeighborsClassifier(n_neighbors=k)
-		accuracy.append(classify(train_data, test_data, train_class, test_class, knn))
-	draw_graph(k_list, accuracy, 'kNN', special_point=(10, accuracy[6]), xt=[i for i in range(1, 101, 3)])
+	for tree in rfc.estimators_:
+		votes += tree.predict_proba(test_data)
+		y_pred = rfc.classes_[votes.argmax(axis=1)]
+		accuracy.append(int(np.count_nonzero(y_pred == test_class)) / test_data.shape[0])
 	return accuracy
 
 
-def random_forest(train_data, test_data, train_class, test_class):
+def random_forest(train_data, test_data, train_class, test_class, n_jobs=None, random_state=RANDOM_STATE):
 	"""
 	Uses sklearn's RandomForestClassifier in sklearn. We run it for n values from 1 to 100.
 	:param train_data: The training data.
 	:param test_data: The testing data.
 	:param train_class: The list of training classes.
 	:param test_class: The list of testing classes.
+	:param n_jobs: The number of trees trained in parallel. Default value is None, i.e. 1.
+	:param random_state: The seed of the forest.
 	:return: The lis of accuracies for each k value.
 	"""
-	accuracy = []
-	last_accuracy = -1
-	for n in range(1, 101):
-		rfc = RandomForestClassifier(n_estimators=n)
-		acc = classify(train_data, test_data, train_class, test_class, rfc)
-		if n % 2 != 0:
-			last_accuracy = acc
-		else:
-			accuracy.append((acc + last_accuracy) / 2)
+	return draw_forest(forest_sweep(train_data, test_data, train_class, test_class, N_TREES, n_jobs, random_state))
+
+
+def draw_forest(accuracy_n):
+	"""
+	Draws the accuracy of the random forests for every even number of trees, averaged with the odd one before it.
+	:param accuracy_n: The list of accuracies for each number of trees from forest_sweep.
+	:return: The list of averaged accuracies.
+	"""
+	accuracy = [(accuracy_n[n - 2] + accuracy_n[n - 1]) / 2 for n in range(2, N_TREES + 1, 2)]
 	draw_graph([n for n in range(2, 101, 2)], accuracy, 'Random Forest Classifier', special_point=(16, accuracy[7]))
 	return accuracy
 
@@ -159,17 +262,56 @@ def draw_graph(x_list, y_list, name='', special_point=None, xt=None):
 	plt.show()
 
 
+def parse_args():
+	"""
+	Parses the command line arguments.
+	:return: The arguments.
+	"""
+	parser = argparse.ArgumentParser(description='Finds the accuracy of kNN and random forests on the collisions.')
+	parser.add_argument('--input', default='clean_classified.csv', help='The classified collisions file.')
+	parser.add_argument('--save', metavar='FILE', help='Train the most accurate model on all the data and save it.')
+	parser.add_argument('--categorical', choices=['codes', 'one_hot'],
+						help='Also use the ZIP code, vehicle types and factors of the feature store.')
+	parser.add_argument('--groups', nargs='+', default=list(feature_store.GROUPS), choices=list(feature_store.GROUPS),
+						help='The categorical columns to use.')
+	parser.add_argument('--clean', default='clean.csv', help='The cleaned collisions file the store is built from.')
+	parser.add_argument('--n-jobs', type=int, help='The number of trees of the forest trained in parallel, -1 for one '
+												   'per core. Default value is 1.')
+	instrument.add_arguments(parser)
+	args = parser.parse_args()
+	if args.save is not None and args.categorical is not None:
+		parser.error('saved models only use the features of model.FEATURES, --categorical cannot be saved')
+	return args
+
+
 def main():
-	file = file_check('clean_classified.csv', 'r')
-	attrs, data, classes = read_csv(file)
+	args = parse_args()
+	recorder = instrument.enable_from(args)
+	with instrument.stage('load') as stage:
+		attrs, data, classes = load_data(args.input)
+		if args.categorical is not None:
+			data = add_categorical(data, args.input, args.clean, args.categorical, args.groups)
+		stage.rows = data.shape[0]
 	train_data, test_data, train_class, test_class = train_test_split(data, classes)
 	print(data.shape, classes.shape)
 	print(data)
 	print(classes)
-	accuracy_knn = knn(train_data, test_data, train_class, test_class)
+	with instrument.stage('knn', data.shape[0]):
+		accuracy_knn = knn(train_data, test_data, train_class, test_class)
 	print('knn', accuracy_knn)
-	accuracy_rf = random_forest(train_data, test_data, train_class, test_class)
+	with instrument.stage('random_forest', data.shape[0]):
+		accuracy_n = forest_sweep(train_data, test_data, train_class, test_class, n_jobs=args.n_jobs)
+		accuracy_rf = draw_forest(accuracy_n)
 	print('random forest', accuracy_rf)
+	if args.save is not None:
+		with instrument.stage('save', data.shape[0]):
+			results = model.sweep_rows('knn', K_LIST, accuracy_knn, SPLIT) +\
+					  model.sweep_rows('random_forest', range(1, N_TREES + 1), accuracy_n, SPLIT, RANDOM_STATE)
+			trained, schema = model.train(data, classes, model.best(results))
+			model.save(args.save, trained, schema)
+		print('saved', model.describe(schema))
+	if recorder is not None:
+		print(recorder.report())
 
 if __name__ == '__main__':
 	main()
@@ -1,5 +1,8 @@
 from matplotlib import pyplot as matplot
-import datetime as dt
+import numpy as np
+from parsing import find_day, find_time
+from build_features import COLUMNS
+import csv_parser
 
 CLASSES = ['Safe', 'Injured', 'Killed']
 DAYS = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY']
@@ -11,27 +14,23 @@ class Incident:
 				'safety_class'
 
 	def __init__(self, point):
-		self.id = int(point[1])
-		self.date = point[2]
+		self.id = int(point['id'])
+		self.date = point['date']
 		self.day = self.find_day()
-		self.time = point[3]
+		self.time = point['time']
 		self.time_class = self.find_time()
-		self.borough = BOROUGHS.index(point[4])
-		self.latitude = float(point[6])
-		self.longitude = float(point[7])
-		self.injured = int(point[13])
-		self.killed = int(point[14])
+		self.borough = BOROUGHS.index(point['borough'])
+		self.latitude = float(point['latitude'])
+		self.longitude = float(point['longitude'])
+		self.injured = int(point['injured'])
+		self.killed = int(point['killed'])
 		self.safety_class = self.find_safety()
 
 	def find_day(self):
-		if '/' in self.date:
-			day = dt.datetime.strptime(self.date, '%m/%d/%Y').date().weekday()
-		else:
-			day = dt.datetime.strptime(self.date, '%m-%d-%y').date().weekday()
-		return day
+		return find_day(self.date)
 
 	def find_time(self):
-		return int(self.time.split(':')[0])
+		return find_time(self.time)
 
 	def find_safety(self):
 		if self.killed > 0:
@@ -69,43 +68,28 @@ def read_csv(file):
     """
 	attrs = 'ID,DATE,TIME,BOROUGH,LATITUDE,LONGITUDE,CLASS'
 	data_points = []
-	# j = 0
-	# matplot.figure("Map", (30, 10))
-	# matplot.title('Map')
-	# j = 0
-	file.readline()
-	for line in file:
-		if line == '\n' or line.strip() == '':
-			continue
-		line = line.strip().split(',')
-		for i in range(len(line)):
-			line[i] = line[i].strip('"')
-		data_points.append(Incident(line))
+	parser = csv_parser.Parser(file, COLUMNS)
+	for row, point in parser.rows():
+		try:
+			data_points.append(Incident(point))
+		except ValueError:
+			parser.quarantine.add(row, 'bad row', point.values())
+	if parser.quarantine.total() > 0:
+		print(parser.quarantine)
 	return attrs, data_points
 
 
 def draw_map(data, name='ALL'):
-	class2 = False
-	class1 = False
-	class0 = False
 	matplot.figure(name, (30, 10))
 	matplot.title(name)
 	point = ['ro', 'go', 'bo']
-	for incident in data:
-		x = incident.longitude
-		y = incident.latitude
-		safety_class = incident.safety_class
-		if not class2 and safety_class == 2:
-			matplot.plot(x, y, point[safety_class], label=CLASSES[safety_class])
-			class2 = True
-		elif not class1 and safety_class == 1:
-			matplot.plot(x, y, point[safety_class], label=CLASSES[safety_class])
-			class1 = True
-		elif not class0 and safety_class == 0:
-			matplot.plot(x, y, point[safety_class], label=CLASSES[safety_class])
-			class0 = True
-		else:
-			matplot.plot(x, y, point[safety_class])
+	longitude = np.fromiter([incident.longitude for incident in data], np.float64, len(data))
+	latitude = np.fromiter([incident.latitude for incident in data], np.float64, len(data))
+	safety = np.fromiter([incident.safety_class for incident in data], np.uint8, len(data))
+	for safety_class in range(len(CLASSES)):
+		mask = safety == safety_class
+		if mask.any():
+			matplot.plot(longitude[mask], latitude[mask], point[safety_class], label=CLASSES[safety_class])
 	matplot.legend(loc='upper right')
 	matplot.show()
 
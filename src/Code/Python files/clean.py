@@ -0,0 +1,158 @@
+"""
+Cleans the raw NYPD collision export in a single streaming pass, in place of car_collisions_cleaning.R: it selects and
+renames the useful columns, derives the date, day, month and hour of every collision and drops the collisions that have
+no location or borough. Only one chunk of the export is in memory at a time, and the chunks can be fed straight to
+build_features (build_features.py --raw) instead of being written to clean.csv first.
+"""
+import argparse
+import csv
+from collections import Counter
+import datetime as dt
+import numpy as np
+import csv_parser
+import fileio
+from parsing import find_ordinal, find_time, format_date
+
+BOROUGHS = ['MANHATTAN', 'BRONX', 'QUEENS', 'BROOKLYN', 'STATEN ISLAND']
+CLASSES = ['SAFE', 'INJURED', 'KILLED']
+CHUNK_SIZE = 100000
+INCIDENT_COLUMNS = [csv_parser.Column('id', ['UNIQUE KEY', 'COLLISION_ID'], 'int', default='row'),
+					csv_parser.Column('date', ['CRASH DATE'], find_ordinal),
+					csv_parser.Column('time', ['CRASH TIME', 'HOUR'], find_time),
+					csv_parser.Column('borough', []),
+					csv_parser.Column('latitude', []),
+					csv_parser.Column('longitude', []),
+					csv_parser.Column('injured', ['PERSONS INJURED', 'NUMBER OF PERSONS INJURED',
+												  'TOTAL PEOPLE INJURED'], 'int'),
+					csv_parser.Column('killed', ['PERSONS KILLED', 'NUMBER OF PERSONS KILLED', 'TOTAL PEOPLE KILLED'],
+									  'int'),
+					csv_parser.Column('pedestrian_injured', ['PEDESTRIANS INJURED', 'NUMBER OF PEDESTRIANS INJURED',
+															 'TOTAL PEDESTRIANS INJURED'], 'int', default=0),
+					csv_parser.Column('pedestrian_killed', ['PEDESTRIANS KILLED', 'NUMBER OF PEDESTRIANS KILLED',
+															'TOTAL PEDESTRIANS KILLED'], 'int', default=0)]
+COLUMNS = INCIDENT_COLUMNS + [csv_parser.Column('zip_code', ['ZIP CODE'], default='')] +\
+		  [csv_parser.Column('vehicle_' + str(i) + '_type', ['VEHICLE TYPE CODE ' + str(i), 'VEHICLE ' + str(i) + ' TYPE'],
+							 default='') for i in (1, 2)] +\
+		  [csv_parser.Column('vehicle_' + str(i) + '_factor', ['CONTRIBUTING FACTOR VEHICLE ' + str(i),
+															   'VEHICLE ' + str(i) + ' FACTOR'], default='')
+		   for i in range(1, 6)]
+HEADER = ['ID', 'DATE', 'BOROUGH', 'ZIP.CODE', 'LATITUDE', 'LONGITUDE', 'PERSONS.INJURED', 'PERSONS.KILLED',
+		  'PEDESTRIANS.INJURED', 'PEDESTRIANS.KILLED', 'VEHICLE.1.TYPE', 'VEHICLE.2.TYPE', 'VEHICLE.1.FACTOR',
+		  'VEHICLE.2.FACTOR', 'VEHICLE.3.FACTOR', 'VEHICLE.4.FACTOR', 'VEHICLE.5.FACTOR', 'day', 'month', 'hour',
+		  'Classify']
+WRITTEN = ['id', 'date', 'borough', 'zip_code', 'latitude', 'longitude', 'injured', 'killed', 'pedestrian_injured',
+		   'pedestrian_killed', 'vehicle_1_type', 'vehicle_2_type', 'vehicle_1_factor', 'vehicle_2_factor',
+		   'vehicle_3_factor', 'vehicle_4_factor', 'vehicle_5_factor', 'day', 'month', 'time', 'class']
+
+
+def clean_chunk(fields, filtered=None):
+	"""
+	Drops the collisions of a chunk that have no location or borough, and converts the rest.
+	:param fields: The dictionary of an array for every column, as read with COLUMNS.
+	:param filtered: The Counter of the dropped collisions by reason. Default value is None.
+	:return: The dictionary of an array for every column of the kept collisions, the borough being its index in
+	BOROUGHS, the latitude and longitude floats and the date an ordinal.
+	"""
+	filtered = Counter() if filtered is None else filtered
+	borough = np.char.upper(fields['borough'])
+	codes = np.full(len(borough), -1, dtype=np.int64)
+	for i, name in enumerate(BOROUGHS):
+		codes[borough == name] = i
+	keep = codes >= 0
+	filtered['missing borough'] += int(np.count_nonzero(~keep))
+	latitude, bad_latitude = csv_parser.convert(fields['latitude'], 'float')
+	longitude, bad_longitude = csv_parser.convert(fields['longitude'], 'float')
+	located = ~(bad_latitude | bad_longitude) & (latitude != 0) & (longitude != 0)
+	filtered['missing location'] += int(np.count_nonzero(keep & ~located))
+	keep &= located
+	cleaned = {name: values[keep] for name, values in fields.items()}
+	cleaned['borough'] = codes[keep]
+	cleaned['latitude'] = latitude[keep]
+	cleaned['longitude'] = longitude[keep]
+	return cleaned
+
+
+def read_chunks(file, chunk_size=CHUNK_SIZE, quarantine=None, filtered=None):
+	"""
+	Lazily reads and cleans the raw export one chunk at a time.
+	:param file: File handler
+	:param chunk_size: The maximum number of rows read at once.
+	:param quarantine: The csv_parser.Quarantine to put unreadable rows in. Default value is None.
+	:param filtered: The Counter of the dropped collisions by reason. Default value is None.
+	:return: A generator of the cleaned chunks, each a dictionary of an array for every column, which
+	build_features.IncidentColumns can be built from.
+	"""
+	for fields in csv_parser.Parser(file, COLUMNS, quarantine=quarantine).chunks(chunk_size):
+		cleaned = clean_chunk(fields, filtered)
+		if len(cleaned['id']) > 0:
+			yield cleaned
+
+
+def derive(cleaned):
+	"""
+	Derives the day, month and safety class columns of a cleaned chunk, as the R cleaning did.
+	:param cleaned: The cleaned chunk.
+	:return: The dictionary of the columns to write, as strings.
+	"""
+	ordinals, inverse = np.unique(cleaned['date'], return_inverse=True)
+	dates = [dt.date.fromordinal(int(ordinal)) for ordinal in ordinals]
+	columns = {name: cleaned[name].astype(str) for name in WRITTEN if name in cleaned}
+	columns['date'] = np.array([format_date(int(ordinal)) for ordinal in ordinals], dtype=object)[inverse]
+	columns['day'] = np.array([date.strftime('%a') for date in dates], dtype=object)[inverse]
+	columns['month'] = np.array([date.strftime('%b') for date in dates], dtype=object)[inverse]
+	columns['borough'] = np.array(BOROUGHS, dtype=object)[cleaned['borough']]
+	columns['latitude'] = [repr(value) for value in cleaned['latitude'].tolist()]
+	columns['longitude'] = [repr(value) for value in cleaned['longitude'].tolist()]
+	safety = np.where(cleaned['killed'] > 0, 2, np.where(cleaned['injured'] > 0, 1, 0))
+	columns['class'] = np.array(CLASSES, dtype=object)[safety]
+	return columns
+
+
+def write_clean(file_in, file_out, chunk_size=CHUNK_SIZE, quarantine=None, filtered=None):
+	"""
+	Writes the cleaned export in the format of clean.csv, with the ID of every collision in front.
+	:param file_in: The raw export to read.
+	:param file_out: The file to write.
+	:param chunk_size: The maximum number of rows held in memory.
+	:param quarantine: The csv_parser.Quarantine to put unreadable rows in. Default value is None.
+	:param filtered: The Counter of the dropped collisions by reason. Default value is None.
+	:return: The number of collisions written.
+	"""
+	writer = csv.writer(file_out, lineterminator='\n')
+	writer.writerow(HEADER)
+	count = 0
+	for cleaned in read_chunks(file_in, chunk_size, quarantine, filtered):
+		columns = derive(cleaned)
+		writer.writerows(zip(*(columns[name] for name in WRITTEN)))
+		count += len(cleaned['id'])
+	return count
+
+
+def parse_args():
+	"""
+	Parses the command line arguments.
+	:return: The arguments.
+	"""
+	parser = argparse.ArgumentParser(description='Cleans the raw collision export into clean.csv.')
+	parser.add_argument('input', help='The raw export, may end in .gz or .zst.')
+	parser.add_argument('--output', default='clean.csv', help='The cleaned file, may end in .gz or .zst.')
+	parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='The number of rows held in memory.')
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	quarantine = csv_parser.Quarantine()
+	filtered = Counter()
+	file_in = fileio.open_file(args.input, 'r')
+	file_out = fileio.open_file(args.output, 'w')
+	count = write_clean(file_in, file_out, args.chunk_size, quarantine, filtered)
+	file_in.close()
+	file_out.close()
+	print('written', count, 'collisions, dropped', ', '.join(str(n) + ' ' + reason for reason, n in
+															 sorted(filtered.items())) or 'none')
+	if quarantine.total() > 0:
+		print(quarantine)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,189 @@
+"""
+Cross-validates the classifier sweeps instead of trusting a single 70/30 split. Every fold of every model is trained
+and scored in a pool of worker processes, so k folds take about as long as one when there are k cores.
+
+	kfold		the rows are shuffled and cut into k folds, each fold being tested on once by the model trained on the
+				other k - 1
+	forward		the rows are sorted by date and cut into k + 1 blocks, fold i being trained on the first i blocks and
+				tested on block i + 1, so that the model never sees the future. A day is never split between two
+				blocks. The dates are the ones build_features.py stores next to the classified file, since the file
+				itself only keeps the day of the week
+"""
+import argparse
+import csv
+import multiprocessing as mp
+import os
+import numpy as np
+import classifier
+import dataset_cache
+import experiments
+import model
+import shared_data
+
+SCHEMES = ['kfold', 'forward']
+FOLDS = 5
+FIELDS = ['model', 'scheme', 'fold', 'seed', 'parameter', 'value', 'train', 'test', 'accuracy']
+
+
+def find_folds(n, folds=FOLDS, scheme='kfold', seed=0, dates=None):
+	"""
+	Finds the rows of the training and testing data of every fold.
+	:param n: The number of rows.
+	:param folds: The number of folds.
+	:param scheme: 'kfold' or 'forward'.
+	:param seed: The seed of the shuffle of kfold.
+	:param dates: The date ordinal of every row, which forward needs. Default value is None.
+	:return: A list of (training rows, testing rows) index arrays. A forward fold whose block is empty, because a
+	single day spans several blocks, is left out.
+	"""
+	if scheme == 'kfold':
+		blocks = np.array_split(np.random.RandomState(seed).permutation(n), folds)
+		return [(np.sort(np.concatenate(blocks[:i] + blocks[i + 1:])), np.sort(blocks[i])) for i in range(folds)]
+	if scheme == 'forward':
+		if dates is None or len(dates) != n:
+			raise ValueError('forward chaining needs the date of every row; rebuild the classified file with '
+							 'build_features.py to store them')
+		order = np.argsort(dates, kind='stable')
+		ordered = np.asarray(dates)[order]
+		bounds = np.linspace(0, n, folds + 2).astype(np.int64)
+		bounds[1:-1] = np.searchsorted(ordered, ordered[bounds[1:-1]])
+		return [(np.sort(order[:bounds[i + 1]]), np.sort(order[bounds[i + 1]:bounds[i + 2]])) for i in range(folds)
+				if 0 < bounds[i + 1] < bounds[i + 2]]
+	raise ValueError('Unknown scheme ' + scheme)
+
+
+def configurations(models, folds, scheme='kfold', seed=0):
+	"""
+	Lists the tasks to run, one per model and fold.
+	:param models: The names of the models.
+	:param folds: The list of (training rows, testing rows) of the folds.
+	:param scheme: The scheme the folds were cut with.
+	:param seed: The random seed of the forests.
+	:return: A list of (model, scheme, fold number, seed, training rows, testing rows) tasks.
+	"""
+	return [(name, scheme, i, seed if name == 'random_forest' else None, train, test)
+			for name in models for i, (train, test) in enumerate(folds)]
+
+
+def run_fold(task):
+	"""
+	Runs the sweep of a single model on a single fold. Runs in a worker process.
+	:param task: The (model, scheme, fold number, seed, training rows, testing rows) task.
+	:return: A list of result rows.
+	"""
+	name, scheme, fold, seed, train, test = task
+	data, classes = experiments._data, experiments._classes
+	if name == 'knn':
+		values = classifier.K_LIST
+		accuracy = classifier.knn_sweep(data[train], data[test], classes[train], classes[test], values)
+	elif name == 'random_forest':
+		values = list(range(1, classifier.N_TREES + 1))
+		accuracy = classifier.forest_sweep(data[train], data[test], classes[train], classes[test], random_state=seed)
+	else:
+		raise ValueError('Unknown model ' + name)
+	rows = model.sweep_rows(name, values, accuracy, None, seed)
+	for row in rows:
+		row.update(scheme=scheme, fold=fold, train=len(train), test=len(test))
+	return rows
+
+
+def run(data, classes, tasks, workers=None):
+	"""
+	Runs the tasks in a pool of worker processes, printing every fold as it finishes.
+	:param data: The data.
+	:param classes: A list of classes.
+	:param tasks: The list of tasks.
+	:param workers: The number of worker processes. Default value is None, i.e. one per core.
+	:return: The list of result rows, sorted by model, fold and value.
+	"""
+	results = []
+	with shared_data.share({'data': data, 'classes': classes}) as shared:
+		with mp.Pool(workers, initializer=experiments.init_worker, initargs=(shared.descriptor,)) as pool:
+			for rows in pool.imap_unordered(run_fold, tasks, chunksize=1):
+				best = model.best(rows)
+				print(best['model'], 'fold', best['fold'], 'best', best['parameter'], '=', best['value'], 'accuracy',
+					  round(best['accuracy'], 4))
+				results.extend(rows)
+	results.sort(key=lambda row: (row['model'], row['fold'], row['value']))
+	return results
+
+
+def summarize(results):
+	"""
+	Averages the accuracy of every model and hyperparameter value over the folds.
+	:param results: The list of result rows.
+	:return: A list of summary rows with the mean, standard deviation and per-fold accuracies.
+	"""
+	groups = {}
+	for row in results:
+		groups.setdefault((row['model'], row['parameter'], row['value']), []).append(row['accuracy'])
+	return [{'model': name, 'parameter': parameter, 'value': value, 'mean': float(np.mean(accuracy)),
+			 'std': float(np.std(accuracy)), 'folds': accuracy}
+			for (name, parameter, value), accuracy in sorted(groups.items())]
+
+
+def report(summary):
+	"""
+	Describes the best value of every model.
+	:param summary: The list of summary rows.
+	:return: The report.
+	"""
+	lines = []
+	for name in sorted({row['model'] for row in summary}):
+		best = max((row for row in summary if row['model'] == name), key=lambda row: row['mean'])
+		lines.append(name + ': best ' + best['parameter'] + ' = ' + str(best['value']) + ', accuracy ' +
+					 '%.4f +- %.4f' % (best['mean'], best['std']) + ', folds ' +
+					 ' '.join('%.4f' % accuracy for accuracy in best['folds']))
+	return '\n'.join(lines)
+
+
+def write_results(results, summary, name):
+	"""
+	Writes the per-fold results and their summary as csv files.
+	:param results: The list of result rows.
+	:param summary: The list of summary rows.
+	:param name: The name of the files without the extension.
+	:return: None.
+	"""
+	with open(name + '.csv', 'w', newline='') as file:
+		writer = csv.DictWriter(file, FIELDS, extrasaction='ignore')
+		writer.writeheader()
+		writer.writerows(results)
+	with open(name + '_summary.csv', 'w', newline='') as file:
+		writer = csv.writer(file)
+		writer.writerow(['model', 'parameter', 'value', 'mean', 'std'])
+		for row in summary:
+			writer.writerow([row['model'], row['parameter'], row['value'], row['mean'], row['std']])
+
+
+def parse_args():
+	"""
+	Parses the command line arguments.
+	:return: The arguments.
+	"""
+	parser = argparse.ArgumentParser(description='Cross-validates the classifier sweeps in parallel.')
+	parser.add_argument('--input', default='clean_classified.csv', help='The classified collisions file.')
+	parser.add_argument('--models', nargs='+', default=experiments.MODELS, choices=experiments.MODELS)
+	parser.add_argument('--scheme', default='kfold', choices=SCHEMES, help='How the folds are cut.')
+	parser.add_argument('--folds', type=int, default=FOLDS, help='The number of folds.')
+	parser.add_argument('--seed', type=int, default=0, help='The seed of the shuffle and of the forests.')
+	parser.add_argument('--workers', type=int, default=os.cpu_count(), help='The number of worker processes.')
+	parser.add_argument('--output', default='cross_validation', help='The results file name without the extension.')
+	args = parser.parse_args()
+	if args.folds < 2 and args.scheme == 'kfold':
+		parser.error('kfold needs at least 2 folds')
+	return args
+
+
+def main():
+	args = parse_args()
+	attrs, data, classes = classifier.load_data(args.input)
+	dates = dataset_cache.read_dates(args.input) if args.scheme == 'forward' else None
+	folds = find_folds(len(data), args.folds, args.scheme, args.seed, dates)
+	results = run(data, classes, configurations(args.models, folds, args.scheme, args.seed), args.workers)
+	summary = summarize(results)
+	write_results(results, summary, args.output)
+	print(report(summary))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,225 @@
+"""
+Reads csv files by column name. The fields are split by the csv module, so quoted fields may contain commas, and
+every column is converted to its type in bulk. Rows that cannot be read are put in quarantine and counted instead of
+stopping the whole file.
+"""
+import csv
+import re
+from collections import Counter
+import numpy as np
+
+CHUNK_SIZE = 100000
+QUARANTINE_SIZE = 100
+
+
+def normalize(name):
+	"""
+	Normalizes a column name so that e.g. 'PERSONS.INJURED', 'persons injured' and 'PERSONS_INJURED' are the same.
+	:param name: The name.
+	:return: The normalized name.
+	"""
+	return re.sub('[^A-Z0-9]+', '_', name.upper()).strip('_')
+
+
+class Column:
+	"""
+	Describes a column to read: its name, the other names it may have in the header, its type and what to use when
+	the file does not have it.
+	"""
+	__slots__ = 'name', 'aliases', 'kind', 'default'
+
+	def __init__(self, name, aliases=(), kind='str', default=None):
+		"""
+		:param name: The name of the field the column is read into.
+		:param aliases: The other names of the column.
+		:param kind: 'int', 'float', 'str', or a function applied to every distinct value of the column.
+		:param default: The value of the field when the file has no such column, 'row' for the row number, or None if
+		the column is required.
+		"""
+		self.name = name
+		self.aliases = tuple(aliases)
+		self.kind = kind
+		self.default = default
+
+
+class Quarantine:
+	"""
+	Counts the rows that could not be read by reason, and keeps the first few of them.
+	"""
+	__slots__ = 'counts', 'rows', 'limit'
+
+	def __init__(self, limit=QUARANTINE_SIZE):
+		self.counts = Counter()
+		self.rows = []
+		self.limit = limit
+
+	def add(self, row, reason, fields):
+		"""
+		Puts a row in quarantine.
+		:param row: The row number.
+		:param reason: Why the row could not be read.
+		:param fields: The fields of the row.
+		:return: None.
+		"""
+		self.counts[reason] += 1
+		if len(self.rows) < self.limit:
+			self.rows.append((row, reason, list(fields)))
+
+	def merge(self, other):
+		"""
+		Adds the rows of another quarantine to this one.
+		:param other: The other quarantine.
+		:return: None.
+		"""
+		self.counts.update(other.counts)
+		self.rows.extend(other.rows[:self.limit - len(self.rows)])
+
+	def total(self):
+		return sum(self.counts.values())
+
+	def write(self, file_name):
+		"""
+		Writes the rows kept in quarantine to a csv file.
+		:param file_name: The name of the file.
+		:return: None.
+		"""
+		with open(file_name, 'w', newline='') as file:
+			writer = csv.writer(file)
+			writer.writerow(['ROW', 'REASON', 'FIELDS'])
+			for row, reason, fields in self.rows:
+				writer.writerow([row, reason] + fields)
+
+	def __str__(self):
+		return 'quarantined ' + str(self.total()) + ' rows' +\
+			   ''.join(', ' + str(count) + ' ' + reason for reason, count in sorted(self.counts.items()))
+
+
+def convert(values, kind):
+	"""
+	Converts a column to its type.
+	:param values: The array of strings.
+	:param kind: 'int', 'float', 'str' or a function applied to every distinct value.
+	:return: The array of values and the mask of the values that could not be converted.
+	"""
+	if kind == 'str':
+		return values, np.zeros(len(values), dtype=bool)
+	if kind in ('int', 'float'):
+		try:
+			return values.astype(np.int64 if kind == 'int' else np.float64), np.zeros(len(values), dtype=bool)
+		except ValueError:
+			kind = int if kind == 'int' else float
+	distinct, inverse = np.unique(values, return_inverse=True)
+	results = []
+	bad = np.zeros(len(distinct), dtype=bool)
+	for i, value in enumerate(distinct.tolist()):
+		try:
+			results.append(kind(value.strip()))
+		except (ValueError, TypeError, KeyError):
+			results.append(0)
+			bad[i] = True
+	return np.array(results)[inverse], bad[inverse]
+
+
+class Parser:
+	"""
+	Reads the rows of a csv file, finding the columns by the names in its header.
+	"""
+	__slots__ = 'reader', 'header', 'columns', 'index', 'first_row', 'quarantine'
+
+	def __init__(self, lines, columns, header=None, first_row=0, quarantine=None):
+		"""
+		:param lines: The file handler, or any iterable of lines.
+		:param columns: The list of Columns to read.
+		:param header: The header, if the lines do not start with it. Default value is None.
+		:param first_row: The number of rows before the first line, when reading part of a file. Default value is 0.
+		:param quarantine: The Quarantine to put unreadable rows in. Default value is None, i.e. a new one.
+		"""
+		self.reader = csv.reader(lines)
+		if header is None:
+			header = next(self.reader, [])
+			first_row -= 1
+		elif isinstance(header, str):
+			header = next(csv.reader([header]))
+		self.header = [name.strip() for name in header]
+		self.columns = columns
+		self.first_row = first_row
+		self.quarantine = Quarantine() if quarantine is None else quarantine
+		positions = {}
+		for position, name in enumerate(self.header):
+			positions.setdefault(normalize(name), position)
+		self.index = {}
+		for column in columns:
+			for name in (column.name,) + column.aliases:
+				if normalize(name) in positions:
+					self.index[column.name] = positions[normalize(name)]
+					break
+			else:
+				if column.default is None:
+					raise ValueError('The file has no ' + ' or '.join((column.name,) + column.aliases) + ' column')
+
+	def records(self):
+		"""
+		Reads the rows that have as many fields as the header, skipping blank lines.
+		:return: A generator of (row number, fields).
+		"""
+		width = len(self.header)
+		for fields in self.reader:
+			if len(fields) == 0 or (len(fields) == 1 and fields[0].strip() == ''):
+				continue
+			row = self.first_row + self.reader.line_num
+			if len(fields) != width:
+				self.quarantine.add(row, 'wrong number of fields', fields)
+				continue
+			yield row, fields
+
+	def rows(self):
+		"""
+		Reads the rows one at a time without converting them.
+		:return: A generator of (row number, dictionary of the fields of every column as strings).
+		"""
+		for row, fields in self.records():
+			point = {}
+			for column in self.columns:
+				if column.name in self.index:
+					point[column.name] = fields[self.index[column.name]].strip()
+				else:
+					point[column.name] = str(row) if column.default == 'row' else str(column.default)
+			yield row, point
+
+	def chunks(self, chunk_size=CHUNK_SIZE):
+		"""
+		Reads the rows in chunks, converting every column of a chunk at once.
+		:param chunk_size: The largest number of rows in a chunk.
+		:return: A generator of dictionaries of an array for every column.
+		"""
+		records = []
+		for record in self.records():
+			records.append(record)
+			if len(records) == chunk_size:
+				yield self.convert(records)
+				records = []
+		if records:
+			yield self.convert(records)
+
+	def convert(self, records):
+		"""
+		Converts a chunk of rows, putting the rows that cannot be converted in quarantine.
+		:param records: The list of (row number, fields).
+		:return: The dictionary of an array for every column.
+		"""
+		rows = np.array([row for row, fields in records], dtype=np.int64)
+		arrays = {}
+		bad = np.zeros(len(records), dtype=bool)
+		for column in self.columns:
+			if column.name not in self.index:
+				arrays[column.name] = rows if column.default == 'row' else np.full(len(records), column.default)
+				continue
+			position = self.index[column.name]
+			values = np.char.strip(np.array([fields[position] for row, fields in records], dtype=str))
+			arrays[column.name], column_bad = convert(values, column.kind)
+			for i in np.flatnonzero(column_bad & ~bad):
+				self.quarantine.add(int(rows[i]), 'bad ' + column.name, records[i][1])
+			bad |= column_bad
+		if bad.any():
+			arrays = {name: values[~bad] for name, values in arrays.items()}
+		return arrays
@@ -0,0 +1,137 @@
+"""
+A dense cube of collision counts indexed by (day, hour, borough, class), with a layer for the count of collisions and
+one for each sum of people injured or killed. The cube is small (7 x 24 x 5 x 3 cells per layer), so any slice of the
+data can be answered from it without reading the rows again.
+"""
+import os
+import numpy as np
+import aggregate
+
+DIMENSIONS = ['day', 'hour', 'borough', 'safety_class']
+LAYERS = ['count', 'injured', 'killed', 'pedestrian_injured', 'pedestrian_killed']
+SHAPE = (aggregate.N_DAYS, aggregate.N_HOURS, aggregate.N_BOROUGHS, aggregate.N_CLASSES)
+
+
+def cube_path(file_name):
+	"""
+	Finds the name of the cube file kept next to a classified csv file.
+	:param file_name: The name of the csv file.
+	:return: The name of the cube file.
+	"""
+	return os.path.splitext(file_name)[0] + '.cube.npz'
+
+
+class CountCube:
+	"""
+	Stores the count of collisions and the number of people injured and killed for every day, hour, borough and
+	class.
+	"""
+	__slots__ = 'layers'
+
+	def __init__(self, layers=None):
+		if layers is None:
+			layers = {layer: np.zeros(SHAPE, dtype=np.int64) for layer in LAYERS}
+		self.layers = layers
+
+	@classmethod
+	def from_data(cls, data):
+		"""
+		Builds the cube of some data.
+		:param data: The data as IncidentColumns.
+		:return: The cube.
+		"""
+		cube = cls()
+		cube.update(data)
+		return cube
+
+	@classmethod
+	def load(cls, file_name):
+		"""
+		Loads a cube written by save.
+		:param file_name: The name of the cube file.
+		:return: The cube.
+		"""
+		with np.load(file_name) as file:
+			return cls({layer: file[layer] for layer in LAYERS})
+
+	def save(self, file_name):
+		"""
+		Writes the cube to a file.
+		:param file_name: The name of the cube file.
+		:return: None.
+		"""
+		with open(file_name, 'wb') as file:
+			np.savez(file, **self.layers)
+
+	def update(self, data):
+		"""
+		Adds new collisions to the cube, e.g. when new days of data are appended.
+		:param data: The new data as IncidentColumns.
+		:return: None.
+		"""
+		key = aggregate.group_key(data.day, data.time_class, data.borough, data.safety_class)
+		self.layers['count'] += aggregate.count(key)
+		for layer in LAYERS[1:]:
+			self.layers[layer] += aggregate.count(key, getattr(data, layer).astype(np.int64))
+
+	def add(self, other):
+		"""
+		Adds the counts of another cube to this one.
+		:param other: The other cube.
+		:return: None.
+		"""
+		for layer in LAYERS:
+			self.layers[layer] += other.layers[layer]
+
+	def select(self, layer='count', **filters):
+		"""
+		Selects the cells of a layer that match the filters.
+		:param layer: The name of the layer.
+		:param filters: The value, or list of values, of any of the DIMENSIONS, e.g. borough=2 or day=[5, 6].
+		:return: The selected cells, with one axis for each of the DIMENSIONS.
+		"""
+		index = []
+		for dimension in DIMENSIONS:
+			value = filters.pop(dimension, None)
+			if value is None:
+				index.append(slice(None))
+			else:
+				index.append(np.atleast_1d(value))
+		if filters:
+			raise ValueError('Unknown dimensions ' + ', '.join(filters))
+		return self.layers[layer][np.ix_(*[np.arange(size)[i] for size, i in zip(SHAPE, index)])]
+
+	def counts(self, **filters):
+		"""
+		Counts the collisions that match the filters, e.g. counts(borough=2, day=6).
+		:param filters: The value, or list of values, of any of the DIMENSIONS.
+		:return: The number of collisions.
+		"""
+		return int(self.select('count', **filters).sum())
+
+	def total(self, layer, **filters):
+		"""
+		Adds up a layer over the collisions that match the filters, e.g. total('killed', hour=[22, 23]).
+		:param layer: The name of the layer.
+		:param filters: The value, or list of values, of any of the DIMENSIONS.
+		:return: The total.
+		"""
+		return int(self.select(layer, **filters).sum())
+
+	def rollup(self, by, layer='count', **filters):
+		"""
+		Adds up a layer over the collisions that match the filters, grouped by some of the dimensions.
+		:param by: The list of dimensions to group by, e.g. ['hour', 'safety_class'].
+		:param layer: The name of the layer. Default value is 'count'.
+		:param filters: The value, or list of values, of any of the DIMENSIONS.
+		:return: An array with one axis for each of the dimensions grouped by, in the order of DIMENSIONS.
+		"""
+		axes = tuple(i for i, dimension in enumerate(DIMENSIONS) if dimension not in by)
+		return self.select(layer, **filters).sum(axis=axes)
+
+	def sums(self):
+		"""
+		Finds the total number of people and the number of pedestrians that were injured and killed.
+		:return: The same values as build_features.find_sums.
+		"""
+		return tuple(self.total(layer) for layer in LAYERS[1:])
@@ -0,0 +1,105 @@
+"""
+Keeps the data of a classified csv file as binary NumPy columns next to it, so that it can be loaded without parsing
+the csv again. The cache is keyed on the size and modification time of the csv file and ignored once it changes.
+The dates of the collisions, which the classified csv file does not keep, are stored beside it the same way.
+"""
+import json
+import os
+import numpy as np
+
+
+def cache_paths(file_name):
+	"""
+	Finds the names of the cache files kept next to a classified csv file.
+	:param file_name: The name of the csv file.
+	:return: The names of the header, data and classes files.
+	"""
+	base = os.path.splitext(file_name)[0]
+	return base + '.cache.json', base + '.data.npy', base + '.classes.npy'
+
+
+def dates_path(file_name):
+	"""
+	Finds the name of the dates file kept next to a classified csv file.
+	:param file_name: The name of the csv file.
+	:return: The name of the dates file.
+	"""
+	return os.path.splitext(file_name)[0] + '.dates.npz'
+
+
+def source_key(file_name):
+	"""
+	Finds the key that identifies the current contents of the csv file.
+	:param file_name: The name of the csv file.
+	:return: The size and modification time of the file.
+	"""
+	stat = os.stat(file_name)
+	return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def write_cache(file_name, attrs, data, classes):
+	"""
+	Writes the data of a classified csv file as binary columns so that it can be loaded without parsing the csv.
+	The header is written last so that an interrupted write is never mistaken for a valid cache.
+	:param file_name: The name of the csv file the data was read from.
+	:param attrs: The list of attributes.
+	:param data: The data points.
+	:param classes: The list of classes.
+	:return: None.
+	"""
+	header, data_file, classes_file = cache_paths(file_name)
+	if os.path.exists(header):
+		os.remove(header)
+	np.save(data_file, np.asarray(data, dtype=np.float64))
+	np.save(classes_file, np.asarray(classes, dtype=np.int64))
+	with open(header, 'w') as file:
+		json.dump({'source': source_key(file_name), 'attrs': list(attrs), 'rows': len(classes)}, file)
+
+
+def read_cache(file_name):
+	"""
+	Loads the cached data of a classified csv file. The arrays are memory mapped rather than copied into memory.
+	:param file_name: The name of the csv file.
+	:return: The list of attributes, the data points and the list of classes, or None when there is no cache or the
+	csv file has changed since it was written.
+	"""
+	header, data_file, classes_file = cache_paths(file_name)
+	try:
+		with open(header) as file:
+			meta = json.load(file)
+		if meta['source'] != source_key(file_name):
+			return None
+		data = np.load(data_file, mmap_mode='r')
+		classes = np.load(classes_file, mmap_mode='r')
+	except (OSError, ValueError, KeyError):
+		return None
+	if len(data) != meta['rows'] or len(classes) != meta['rows']:
+		return None
+	return meta['attrs'], data, classes
+
+
+def write_dates(file_name, dates):
+	"""
+	Writes the date of every row of a classified csv file, once the csv file is complete.
+	:param file_name: The name of the csv file.
+	:param dates: The array of date ordinals, one per row in the order of the file.
+	:return: None.
+	"""
+	key = source_key(file_name)
+	np.savez(dates_path(file_name), dates=np.asarray(dates, dtype=np.int32), size=key['size'], mtime=key['mtime'])
+
+
+def read_dates(file_name):
+	"""
+	Loads the dates of the rows of a classified csv file.
+	:param file_name: The name of the csv file.
+	:return: The array of date ordinals, or None when there are none or the csv file has changed since they were
+	written.
+	"""
+	try:
+		with np.load(dates_path(file_name)) as saved:
+			if {'size': int(saved['size']), 'mtime': int(saved['mtime'])} != source_key(file_name):
+				return None
+			return saved['dates']
+	except (OSError, ValueError, KeyError):
+		return None
@@ -0,0 +1,170 @@
+"""
+Runs the classifier sweeps of classifier.py for several models, splits and seeds in a pool of worker processes and
+collects every accuracy into a single results table.
+"""
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import numpy as np
+from matplotlib import pyplot as plt
+import classifier
+import model
+import shared_data
+
+MODELS = ['knn', 'random_forest']
+SPLITS = [.6, .7, .8]
+SEEDS = [0]
+FIELDS = ['model', 'split', 'seed', 'parameter', 'value', 'accuracy']
+
+_data = None
+_classes = None
+
+
+def init_worker(descriptor):
+	"""
+	Attaches the worker process to the data shared by the parent instead of receiving a copy of it.
+	:param descriptor: The descriptor of the shared_data.SharedDataset holding the data and the classes.
+	:return: None.
+	"""
+	global _data, _classes
+	shared = shared_data.attach(descriptor)
+	_data = shared['data']
+	_classes = shared['classes']
+
+
+def split_data(data, classes, split):
+	"""
+	Splits the data into a training data and test data at the given fraction.
+	:param data: The data.
+	:param classes: A list of classes.
+	:param split: The fraction of the rows used for training.
+	:return: Lists of the training data, testing data, training classes and testing classes.
+	"""
+	split_row = int(len(data) * split)
+	return data[:split_row], data[split_row:], classes[:split_row], classes[split_row:]
+
+
+def configurations(models=MODELS, splits=SPLITS, seeds=SEEDS):
+	"""
+	Lists the experiments to run. kNN does not depend on a seed so it is run only once per split.
+	:param models: The names of the models.
+	:param splits: The training fractions.
+	:param seeds: The random seeds.
+	:return: A list of (model, split, seed) experiments.
+	"""
+	experiments = []
+	for split in splits:
+		for name in models:
+			for seed in (seeds if name == 'random_forest' else [None]):
+				experiments.append((name, split, seed))
+	return experiments
+
+
+def run_experiment(experiment):
+	"""
+	Runs the sweep of a single model over all of its hyperparameter values. Runs in a worker process.
+	:param experiment: The (model, split, seed) experiment.
+	:return: A list of result rows.
+	"""
+	name, split, seed = experiment
+	train_data, test_data, train_class, test_class = split_data(_data, _classes, split)
+	if name == 'knn':
+		values = classifier.K_LIST
+		accuracy = classifier.knn_sweep(train_data, test_data, train_class, test_class, values)
+	elif name == 'random_forest':
+		values = list(range(1, classifier.N_TREES + 1))
+		accuracy = classifier.forest_sweep(train_data, test_data, train_class, test_class, random_state=seed)
+	else:
+		raise ValueError('Unknown model ' + name)
+	return model.sweep_rows(name, values, accuracy, split, seed)
+
+
+def run(data, classes, experiments, workers=None):
+	"""
+	Runs the experiments in a pool of worker processes.
+	:param data: The data.
+	:param classes: A list of classes.
+	:param experiments: The list of (model, split, seed) experiments.
+	:param workers: The number of worker processes. Default value is None, i.e. one per core.
+	:return: The list of result rows in the order of the experiments.
+	"""
+	with shared_data.share({'data': data, 'classes': classes}) as shared:
+		with mp.Pool(workers, initializer=init_worker, initargs=(shared.descriptor,)) as pool:
+			results = pool.map(run_experiment, experiments, chunksize=1)
+	return [row for rows in results for row in rows]
+
+
+def write_results(results, name):
+	"""
+	Writes the results table as both a csv and a json file.
+	:param results: The list of result rows.
+	:param name: The name of the files without the extension.
+	:return: None.
+	"""
+	with open(name + '.csv', 'w', newline='') as file:
+		writer = csv.DictWriter(file, FIELDS)
+		writer.writeheader()
+		writer.writerows(results)
+	with open(name + '.json', 'w') as file:
+		json.dump(results, file, indent=1)
+
+
+def draw_results(results):
+	"""
+	Draws the accuracy of every model against its hyperparameter, one line per split averaged over the seeds.
+	:param results: The list of result rows.
+	:return: None.
+	"""
+	for name in sorted({row['model'] for row in results}):
+		rows = [row for row in results if row['model'] == name]
+		f, a = plt.subplots()
+		a.set_title(name)
+		for i, split in enumerate(sorted({row['split'] for row in rows})):
+			curve = {}
+			for row in rows:
+				if row['split'] == split:
+					curve.setdefault(row['value'], []).append(row['accuracy'])
+			values = sorted(curve)
+			a.plot(values, [np.mean(curve[value]) for value in values], classifier.COLORS[i % len(classifier.COLORS)],
+				   label='split = ' + str(split))
+		a.set_xlabel(rows[0]['parameter'])
+		a.set_ylabel('Accuracy')
+		a.grid()
+		a.legend()
+	plt.show()
+
+
+def parse_args():
+	"""
+	Parses the command line arguments.
+	:return: The arguments.
+	"""
+	parser = argparse.ArgumentParser(description='Runs the classifier sweeps in parallel.')
+	parser.add_argument('--input', default='clean_classified.csv', help='The classified collisions file.')
+	parser.add_argument('--models', nargs='+', default=MODELS, choices=MODELS)
+	parser.add_argument('--splits', nargs='+', type=float, default=SPLITS, help='The training fractions.')
+	parser.add_argument('--seeds', nargs='+', type=int, default=SEEDS, help='The random forest seeds.')
+	parser.add_argument('--workers', type=int, default=os.cpu_count(), help='The number of worker processes.')
+	parser.add_argument('--output', default='results', help='The results file name without the extension.')
+	parser.add_argument('--no-plot', action='store_true', help='Only write the results.')
+	parser.add_argument('--save', metavar='FILE', help='Train the most accurate model on all the data and save it.')
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	attrs, data, classes = classifier.load_data(args.input)
+	results = run(data, classes, configurations(args.models, args.splits, args.seeds), args.workers)
+	write_results(results, args.output)
+	print('written', len(results), 'results')
+	if args.save is not None:
+		trained, schema = model.train(data, classes, model.best(results))
+		model.save(args.save, trained, schema)
+		print('saved', model.describe(schema))
+	if not args.no_plot:
+		draw_results(results)
+
+if __name__ == '__main__':
+	main()
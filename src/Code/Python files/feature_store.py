@@ -0,0 +1,247 @@
+"""
+Keeps the categorical columns of clean.csv that build_features drops (the ZIP code, the types of the first two vehicles
+and the five contributing factors) as small integer codes into shared vocabularies: both vehicle types share one
+vocabulary and the five factors another. Code 0 is a missing value. A row costs a few bytes instead of a few hundred,
+and the codes are stored next to clean_classified.csv so that classifier.py can use them as compact arrays or as sparse
+one-hot matrices, matching them to its rows by collision ID.
+"""
+import argparse
+import json
+import os
+import numpy as np
+from scipy import sparse
+import clean
+import csv_parser
+import dataset_cache
+import fileio
+
+VOCABULARIES = {'zip_code': 'ZIP', 'vehicle_1_type': 'TYPE', 'vehicle_2_type': 'TYPE', 'vehicle_1_factor': 'FACTOR',
+				'vehicle_2_factor': 'FACTOR', 'vehicle_3_factor': 'FACTOR', 'vehicle_4_factor': 'FACTOR',
+				'vehicle_5_factor': 'FACTOR'}
+GROUPS = {'zip': ['zip_code'], 'vehicle': ['vehicle_1_type', 'vehicle_2_type'],
+		  'factor': ['vehicle_' + str(i) + '_factor' for i in range(1, 6)]}
+COLUMNS = [column for column in clean.COLUMNS if column.name == 'id' or column.name in VOCABULARIES]
+CHUNK_SIZE = 100000
+
+
+def store_paths(file_name):
+	"""
+	Finds the names of the files of the feature store of a classified csv file.
+	:param file_name: The name of the csv file.
+	:return: The names of the vocabularies and codes files.
+	"""
+	base = os.path.splitext(file_name)[0]
+	return base + '.vocab.json', base + '.codes.npz'
+
+
+def smallest_type(size):
+	"""
+	Finds the smallest unsigned integer type that holds the codes of a vocabulary.
+	:param size: The number of words in the vocabulary, including the missing value.
+	:return: The NumPy type.
+	"""
+	for dtype in (np.uint8, np.uint16):
+		if size <= np.iinfo(dtype).max + 1:
+			return dtype
+	return np.uint32
+
+
+def read_row_ids(file_name):
+	"""
+	Reads the collision IDs of a classified csv file in the order of its rows.
+	:param file_name: The name of the csv file.
+	:return: The array of IDs.
+	"""
+	file = fileio.open_file(file_name, 'r')
+	file.readline()
+	ids = np.array([line.split(',', 1)[0] for line in file if line.strip() != ''], dtype=np.int64)
+	file.close()
+	return ids
+
+
+class FeatureStore:
+	"""
+	The dictionary-encoded categorical columns of the collisions, one row per collision.
+	"""
+	__slots__ = 'ids', 'codes', 'vocabularies'
+
+	def __init__(self, ids, codes, vocabularies):
+		"""
+		:param ids: The array of collision IDs, as int32 like IncidentColumns.
+		:param codes: The dictionary of an array of codes for every column in VOCABULARIES.
+		:param vocabularies: The dictionary of the list of words of every vocabulary, the first being ''.
+		"""
+		self.ids = ids
+		self.codes = codes
+		self.vocabularies = vocabularies
+
+	@classmethod
+	def build(cls, file, chunk_size=CHUNK_SIZE, quarantine=None):
+		"""
+		Encodes a cleaned csv file one chunk at a time, growing the vocabularies as new words are seen.
+		:param file: File handler
+		:param chunk_size: The maximum number of rows held as strings at a time.
+		:param quarantine: The csv_parser.Quarantine to put unreadable rows in. Default value is None.
+		:return: The FeatureStore.
+		"""
+		words = {name: {'': 0} for name in set(VOCABULARIES.values())}
+		ids = []
+		codes = {name: [] for name in VOCABULARIES}
+		for fields in csv_parser.Parser(file, COLUMNS, quarantine=quarantine).chunks(chunk_size):
+			ids.append(fields['id'])
+			for name, vocabulary in VOCABULARIES.items():
+				distinct, inverse = np.unique(np.char.upper(fields[name]), return_inverse=True)
+				index = words[vocabulary]
+				lookup = np.array([index.setdefault(word, len(index)) for word in distinct.tolist()], dtype=np.int64)
+				codes[name].append(lookup[inverse])
+		vocabularies = {name: list(index) for name, index in words.items()}
+		return cls(np.concatenate(ids).astype(np.int32) if ids else np.zeros(0, np.int32),
+				   {name: np.concatenate(parts).astype(smallest_type(len(vocabularies[VOCABULARIES[name]])))
+					if parts else np.zeros(0, np.uint8) for name, parts in codes.items()}, vocabularies)
+
+	def save(self, file_name, source):
+		"""
+		Writes the store next to a classified csv file.
+		:param file_name: The name of the classified csv file.
+		:param source: The name of the cleaned csv file the store was built from.
+		:return: None.
+		"""
+		vocab_file, codes_file = store_paths(file_name)
+		np.savez(codes_file, id=self.ids, **self.codes)
+		with open(vocab_file, 'w') as file:
+			json.dump({'source': dataset_cache.source_key(source), 'columns': VOCABULARIES,
+					   'vocabularies': self.vocabularies}, file)
+
+	@classmethod
+	def load(cls, file_name, source=None):
+		"""
+		Reads the store of a classified csv file.
+		:param file_name: The name of the classified csv file.
+		:param source: The name of the cleaned csv file, to check that it did not change since. Default value is None.
+		:return: The FeatureStore, or None when there is none or it is stale.
+		"""
+		vocab_file, codes_file = store_paths(file_name)
+		try:
+			with open(vocab_file) as file:
+				meta = json.load(file)
+			if source is not None and meta['source'] != dataset_cache.source_key(source):
+				return None
+			with np.load(codes_file) as saved:
+				return cls(saved['id'], {name: saved[name] for name in VOCABULARIES}, meta['vocabularies'])
+		except (OSError, ValueError, KeyError):
+			return None
+
+	def __len__(self):
+		return len(self.ids)
+
+	@property
+	def nbytes(self):
+		return self.ids.nbytes + sum(codes.nbytes for codes in self.codes.values())
+
+	def align(self, ids):
+		"""
+		Finds the codes of the given collisions, e.g. of the rows of clean_classified.csv.
+		:param ids: The array of collision IDs.
+		:return: The FeatureStore with one row per ID, all codes being 0 for an ID not in the store, and the number of
+		such IDs.
+		"""
+		ids = np.asarray(ids, dtype=np.int32)
+		if len(self) == 0:
+			return FeatureStore(ids, {name: np.zeros(len(ids), values.dtype) for name, values in self.codes.items()},
+								self.vocabularies), len(ids)
+		order = np.argsort(self.ids, kind='stable')
+		rows = order[np.searchsorted(self.ids, ids, sorter=order).clip(0, len(order) - 1)]
+		found = self.ids[rows] == ids
+		codes = {name: np.where(found, values[rows], 0).astype(values.dtype) for name, values in self.codes.items()}
+		return FeatureStore(ids, codes, self.vocabularies), int(np.count_nonzero(~found))
+
+	def columns(self, groups=tuple(GROUPS)):
+		"""
+		Lists the columns of some groups.
+		:param groups: The names of the groups in GROUPS. Default value is all of them.
+		:return: The list of column names.
+		"""
+		return [name for group in groups for name in GROUPS[group]]
+
+	def arrays(self, groups=tuple(GROUPS)):
+		"""
+		Gives the codes of some groups as a compact array.
+		:param groups: The names of the groups in GROUPS. Default value is all of them.
+		:return: The array of codes, one row per collision and one column per column of the groups.
+		"""
+		return np.column_stack([self.codes[name] for name in self.columns(groups)])
+
+	def one_hot(self, groups=tuple(GROUPS)):
+		"""
+		Gives some groups as a sparse one-hot matrix. Columns sharing a vocabulary share its block of the matrix, so a
+		collision has a 1 for every factor given for any of its vehicles. Missing values have no column.
+		:param groups: The names of the groups in GROUPS. Default value is all of them.
+		:return: The scipy.sparse CSR matrix, one row per collision and one column per word.
+		"""
+		blocks = []
+		for group in groups:
+			names = GROUPS[group]
+			size = len(self.vocabularies[VOCABULARIES[names[0]]])
+			codes = np.concatenate([self.codes[name].astype(np.int64) for name in names])
+			rows = np.tile(np.arange(len(self)), len(names))
+			present = codes > 0
+			matrix = sparse.csr_matrix((np.ones(np.count_nonzero(present), dtype=np.float32),
+										(rows[present], codes[present] - 1)), shape=(len(self), size - 1))
+			matrix.sum_duplicates()
+			matrix.data[:] = 1
+			blocks.append(matrix)
+		return sparse.hstack(blocks, format='csr')
+
+	def words(self, groups=tuple(GROUPS)):
+		"""
+		Names the columns of the one-hot matrix of some groups.
+		:param groups: The names of the groups in GROUPS. Default value is all of them.
+		:return: The list of names.
+		"""
+		return [group.upper() + '=' + word for group in groups
+				for word in self.vocabularies[VOCABULARIES[GROUPS[group][0]]][1:]]
+
+
+def load_store(file_name, source, chunk_size=CHUNK_SIZE):
+	"""
+	Loads the store of a classified csv file, building it from the cleaned csv file when it is missing or stale.
+	:param file_name: The name of the classified csv file.
+	:param source: The name of the cleaned csv file.
+	:param chunk_size: The maximum number of rows held as strings at a time.
+	:return: The FeatureStore.
+	"""
+	store = FeatureStore.load(file_name, source)
+	if store is None:
+		file = fileio.open_file(source, 'r')
+		store = FeatureStore.build(file, chunk_size)
+		file.close()
+		store.save(file_name, source)
+	return store
+
+
+def parse_args():
+	"""
+	Parses the command line arguments.
+	:return: The arguments.
+	"""
+	parser = argparse.ArgumentParser(description='Encodes the categorical columns of the cleaned collisions.')
+	parser.add_argument('--input', default='clean.csv', help='The cleaned collisions file.')
+	parser.add_argument('--output', default='clean_classified.csv', help='The classified file to store the codes by.')
+	parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='The number of rows held in memory.')
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	quarantine = csv_parser.Quarantine()
+	file = fileio.open_file(args.input, 'r')
+	store = FeatureStore.build(file, args.chunk_size, quarantine)
+	file.close()
+	store.save(args.output, args.input)
+	print('encoded', len(store), 'rows in', store.nbytes, 'bytes,',
+		  ', '.join(name + ' ' + str(len(words) - 1) + ' words' for name, words in sorted(store.vocabularies.items())))
+	if quarantine.total() > 0:
+		print(quarantine)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,31 @@
+"""
+Opens data files with large buffers, compressing or decompressing them on the fly when their name ends in .gz or
+.zst. zstd needs the optional zstandard package.
+"""
+import gzip
+import io
+
+BUFFER_SIZE = 1 << 20
+
+
+def open_file(file, permission):
+	"""
+	Creates a text file handler, compressed according to the extension of the file name.
+	:param file: Name of the file
+	:param permission: Permission, 'r', 'w' or 'a'
+	:return: File handler
+	"""
+	try:
+		if file.endswith('.gz'):
+			return io.TextIOWrapper(io.BufferedWriter(gzip.open(file, permission + 'b'), BUFFER_SIZE)
+									if permission != 'r' else io.BufferedReader(gzip.open(file, 'rb'), BUFFER_SIZE))
+		if file.endswith('.zst'):
+			try:
+				import zstandard
+			except ImportError:
+				raise ImportError('Reading or writing .zst files needs the zstandard package')
+			return zstandard.open(file, permission + 't')
+		return open(file, permission, buffering=BUFFER_SIZE)
+	except FileNotFoundError:
+		print("File", file, "does not exist...")
+		exit()
@@ -0,0 +1,309 @@
+"""
+Appends a new extract of collisions to the outputs of build_features.py without rebuilding them. Only the rows dated
+on or after the stored watermark are considered, and rows whose collision ID was already written are dropped, so an
+update costs time in proportion to the new data rather than to the whole history.
+
+An extract with no ID column, like clean.csv, is de-duplicated on a content key instead: a hash of the date, hour,
+borough, ZIP code, location, casualties, vehicle types and contributing factors of every collision. Distinct collisions
+can still share a key, so the keys are counted rather than kept as a set: a row is only skipped while its key has
+occurred fewer times in the extract so far than it was written. Its rows are given new IDs following the largest one
+written, as row numbers would repeat the IDs of the rows already there.
+"""
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+import build_features
+import clean
+import csv_parser
+import dataset_cache
+import fileio
+from cube import CountCube, cube_path
+
+KEY_FIELDS = ['date', 'time_class', 'borough', 'latitude', 'longitude', 'injured', 'killed']
+KEY_WORDS = ['zip_code', 'vehicle_1_type', 'vehicle_2_type'] + ['vehicle_' + str(i) + '_factor' for i in range(1, 6)]
+COLUMNS = build_features.COLUMNS + [column for column in clean.COLUMNS if column.name in KEY_WORDS]
+
+
+def state_paths(file_name):
+	"""
+	Finds the names of the files that record what has already been written to a classified csv file.
+	:param file_name: The name of the csv file.
+	:return: The names of the watermark, IDs and content keys files.
+	"""
+	base = os.path.splitext(file_name)[0]
+	return base + '.watermark.json', base + '.ids.npy', base + '.keys.npz'
+
+
+def read_ids(file_name):
+	"""
+	Reads the collision IDs of a classified csv file. Only needed once, when there is no IDs file yet.
+	:param file_name: The name of the csv file.
+	:return: The sorted array of IDs.
+	"""
+	file = fileio.open_file(file_name, 'r')
+	file.readline()
+	ids = np.array([line.split(',', 1)[0] for line in file if line.strip() != ''], dtype=np.int64)
+	file.close()
+	return np.unique(ids).astype(np.int32)
+
+
+def hash_words(values):
+	"""
+	Hashes the strings of a column, each distinct string once.
+	:param values: The array of strings.
+	:return: The array of 64 bit hashes.
+	"""
+	distinct, inverse = np.unique(np.char.upper(values), return_inverse=True)
+	hashes = np.array([int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), 'little')
+					   for word in distinct.tolist()], dtype=np.uint64)
+	return hashes[inverse.reshape(-1)]
+
+
+def content_keys(fields, chunk):
+	"""
+	Hashes the fields that tell collisions apart when they have no ID, every column at once.
+	:param fields: The dictionary of an array for every column, as read with COLUMNS.
+	:param chunk: The collisions as IncidentColumns built from the fields.
+	:return: The array of 64 bit keys.
+	"""
+	keys = np.full(len(chunk), 14695981039346656037, dtype=np.uint64)
+	for name in KEY_FIELDS:
+		values = getattr(chunk, name)
+		values = values.view(np.uint64) if values.dtype == np.float64 else values.astype(np.int64).view(np.uint64)
+		keys = (keys ^ values) * np.uint64(1099511628211)
+	for name in KEY_WORDS:
+		keys = (keys ^ hash_words(fields[name])) * np.uint64(1099511628211)
+	return keys
+
+
+def count_keys(counted, keys):
+	"""
+	Finds how many times some keys were counted.
+	:param counted: The (sorted array of distinct keys, array of their counts) pair.
+	:param keys: The array of keys to look up.
+	:return: The array of counts, 0 for a key never counted.
+	"""
+	distinct, counts = counted
+	if len(distinct) == 0:
+		return np.zeros(len(keys), dtype=np.int64)
+	position = np.minimum(np.searchsorted(distinct, keys), len(distinct) - 1)
+	return np.where(distinct[position] == keys, counts[position], 0)
+
+
+def add_keys(counted, keys):
+	"""
+	Counts some more keys.
+	:param counted: The (sorted array of distinct keys, array of their counts) pair.
+	:param keys: The array of keys, a key being counted as often as it occurs.
+	:return: The new pair.
+	"""
+	distinct, inverse = np.unique(np.concatenate([counted[0], keys]), return_inverse=True)
+	counts = np.bincount(inverse.reshape(-1), np.concatenate([counted[1], np.ones(len(keys))]), len(distinct))
+	return distinct, counts.astype(np.int64)
+
+
+def no_keys():
+	"""
+	:return: The pair of counted keys without any key.
+	"""
+	return np.zeros(0, np.uint64), np.zeros(0, np.int64)
+
+
+def read_keys(file_name, chunk_size=build_features.CHUNK_SIZE):
+	"""
+	Counts the content keys and finds the latest date of the cleaned csv file a classified csv file was built from.
+	Only needed once, when an extract with no ID column is first appended after a build.
+	:param file_name: The name of the cleaned csv file.
+	:param chunk_size: The number of rows held in memory at a time.
+	:return: The ordinal of the latest date, or None if the file is empty, and the counted keys.
+	"""
+	latest = None
+	counted = no_keys()
+	file = fileio.open_file(file_name, 'r')
+	for fields in csv_parser.Parser(file, COLUMNS).chunks(chunk_size):
+		chunk = build_features.IncidentColumns(fields)
+		counted = add_keys(counted, content_keys(fields, chunk))
+		latest = int(chunk.date.max()) if latest is None else max(latest, int(chunk.date.max()))
+	file.close()
+	return latest, counted
+
+
+def load_state(file_name):
+	"""
+	Loads the watermark, the IDs and the content keys already written to a classified csv file. If the csv file was
+	changed since the state was saved, e.g. rebuilt by build_features.py, the IDs are read from it again and the
+	watermark and keys are unknown.
+	:param file_name: The name of the csv file.
+	:return: The ordinal of the latest date written, or None if unknown, the sorted array of IDs and the counted
+	content keys, or None if unknown.
+	"""
+	watermark_file, ids_file, keys_file = state_paths(file_name)
+	try:
+		with open(watermark_file) as file:
+			state = json.load(file)
+		if state['source'] == dataset_cache.source_key(file_name):
+			if not os.path.exists(keys_file):
+				return state['date'], np.load(ids_file), None
+			with np.load(keys_file) as saved:
+				return state['date'], np.load(ids_file), (saved['keys'], saved['counts'])
+	except (OSError, ValueError, KeyError):
+		pass
+	return None, read_ids(file_name), None
+
+
+def save_state(file_name, watermark, ids, keys=None):
+	"""
+	Writes the watermark, the IDs and the content keys written to a classified csv file, keyed on its current contents.
+	:param file_name: The name of the csv file.
+	:param watermark: The ordinal of the latest date written.
+	:param ids: The sorted array of IDs.
+	:param keys: The counted content keys, or None if unknown. Default value is None.
+	:return: None.
+	"""
+	watermark_file, ids_file, keys_file = state_paths(file_name)
+	np.save(ids_file, ids)
+	if keys is not None:
+		np.savez(keys_file, keys=keys[0], counts=keys[1])
+	elif os.path.exists(keys_file):
+		os.remove(keys_file)
+	with open(watermark_file, 'w') as file:
+		json.dump({'source': dataset_cache.source_key(file_name), 'date': watermark,
+				   'iso': build_features.format_date(watermark) if watermark else None}, file)
+
+
+def new_rows(chunk, watermark, ids):
+	"""
+	Finds the rows of a chunk that have not been written yet.
+	:param chunk: The chunk as IncidentColumns.
+	:param watermark: The ordinal of the latest date written, or None.
+	:param ids: The sorted array of IDs written.
+	:return: The mask of the new rows.
+	"""
+	keep = np.ones(len(chunk), dtype=bool)
+	if watermark is not None:
+		keep &= chunk.date >= watermark
+	if len(ids) > 0:
+		position = np.minimum(np.searchsorted(ids, chunk.id), len(ids) - 1)
+		keep &= ids[position] != chunk.id
+	first = np.zeros(len(chunk), dtype=bool)
+	first[np.unique(chunk.id, return_index=True)[1]] = True
+	return keep & first
+
+
+def new_occurrences(chunk, watermark, keys, seen, written):
+	"""
+	Finds the rows of a chunk that have not been written yet by their content keys. The n-th occurrence of a key in
+	the extract is new when the key was written fewer than n times.
+	:param chunk: The chunk as IncidentColumns.
+	:param watermark: The ordinal of the latest date written, or None.
+	:param keys: The content keys of the chunk.
+	:param seen: The counted keys of the previous chunks of the extract.
+	:param written: The counted keys written.
+	:return: The mask of the new rows.
+	"""
+	order = np.argsort(keys, kind='stable')
+	ordered = keys[order]
+	rank = np.empty(len(keys), dtype=np.int64)
+	rank[order] = np.arange(len(keys)) - np.searchsorted(ordered, ordered)
+	keep = count_keys(seen, keys) + rank >= count_keys(written, keys)
+	if watermark is not None:
+		keep &= chunk.date >= watermark
+	return keep
+
+
+def ingest(file_in, file_name, chunk_size=build_features.CHUNK_SIZE, source=None):
+	"""
+	Appends the new collisions of an extract to a classified csv file, and updates its count cube, its binary cache,
+	its dates and the watermark.
+	:param file_in: The extract, in the same format as clean.csv.
+	:param file_name: The name of the classified csv file.
+	:param chunk_size: The number of rows of the extract held in memory at a time.
+	:param source: The name of the cleaned csv file the classified csv file was built from, to find the content keys
+	of its rows when the extract has no ID column. Default value is None.
+	:return: The number of rows appended and the number of rows skipped.
+	"""
+	parser = csv_parser.Parser(file_in, COLUMNS)
+	watermark, ids, keys = load_state(file_name)
+	if 'id' not in parser.index and keys is None:
+		if source is None or not os.path.exists(source):
+			raise ValueError('The extract has no ID column, and the collisions already in ' + file_name +
+							 ' can only be told apart from its rows with the cleaned file it was built from')
+		latest, keys = read_keys(source, chunk_size)
+		watermark = latest if watermark is None else watermark
+	next_id = int(ids[-1]) + 1 if len(ids) > 0 else 1
+	cached = dataset_cache.read_cache(file_name)
+	dates = dataset_cache.read_dates(file_name)
+	cube_file = cube_path(file_name)
+	cube = CountCube.load(cube_file) if os.path.exists(cube_file) else None
+	latest = watermark
+	seen = no_keys()
+	parts = []
+	appended = 0
+	skipped = 0
+	file_out = fileio.open_file(file_name, 'a')
+	for fields in parser.chunks(chunk_size):
+		chunk = build_features.IncidentColumns(fields)
+		chunk_keys = content_keys(fields, chunk) if keys is not None else None
+		if 'id' in parser.index:
+			mask = new_rows(chunk, watermark, ids)
+			rows = chunk.select(mask)
+		else:
+			mask = new_occurrences(chunk, watermark, chunk_keys, seen, keys)
+			seen = add_keys(seen, chunk_keys)
+			rows = chunk.select(mask)
+			rows.id = np.arange(next_id, next_id + len(rows), dtype=np.int32)
+			next_id += len(rows)
+		skipped += len(chunk) - len(rows)
+		if len(rows) == 0:
+			continue
+		file_out.write(build_features.format_rows(rows))
+		ids = np.union1d(ids, rows.id).astype(np.int32)
+		if keys is not None:
+			keys = add_keys(keys, chunk_keys[mask])
+		if cube is not None:
+			cube.update(rows)
+		if cached is not None or dates is not None:
+			parts.append(rows)
+		appended += len(rows)
+		latest = int(rows.date.max()) if latest is None else max(latest, int(rows.date.max()))
+	file_out.close()
+	if cube is not None:
+		cube.save(cube_file)
+	if cached is not None:
+		attrs, data, classes = cached
+		data = np.concatenate([data] + [np.column_stack([rows.day, rows.time_class, rows.borough, rows.latitude,
+														 rows.longitude]) for rows in parts])
+		classes = np.concatenate([classes] + [rows.safety_class for rows in parts])
+		dataset_cache.write_cache(file_name, attrs, data, classes)
+	if dates is not None:
+		dataset_cache.write_dates(file_name, np.concatenate([dates] + [rows.date for rows in parts]))
+	save_state(file_name, latest, ids, keys)
+	return appended, skipped
+
+
+def parse_args():
+	"""
+	Parses the command line arguments.
+	:return: The arguments.
+	"""
+	parser = argparse.ArgumentParser(description='Appends a new extract of collisions to the classified data.')
+	parser.add_argument('extract', help='The new extract, in the same format as clean.csv.')
+	parser.add_argument('--output', default='clean_classified.csv', help='The classified collisions file.')
+	parser.add_argument('--source', default='clean.csv',
+						help='The cleaned file the classified file was built from, used when the extract has no ID column.')
+	parser.add_argument('--chunk-size', type=int, default=build_features.CHUNK_SIZE,
+						help='The number of rows held in memory at a time.')
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	file_in = build_features.file_check(args.extract, 'r')
+	appended, skipped = ingest(file_in, args.output, args.chunk_size, args.source)
+	file_in.close()
+	print('appended', appended, 'skipped', skipped)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,249 @@
+"""
+Opt-in timing of the stages of the pipelines. Wrapping code in stage(name) does nothing until enable() is called;
+after that every stage records its wall time, CPU time, rows processed, the resident memory of the process when it
+started and ended and the peak resident memory during it, and can be profiled with cProfile.
+
+On Linux the peak is the stage's own: the high-water mark of the process is reset when a stage starts and read when
+it ends. Elsewhere only the high-water mark of the whole run is known, and peak_rss_scope says which one was recorded.
+The peak of the largest child process of the run, e.g. a render worker, is recorded as well.
+"""
+import cProfile
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+try:
+	import resource
+except ImportError:
+	resource = None
+
+RECORDER = None
+
+
+def rss_kb():
+	"""
+	Finds the current resident memory of the process, on Linux.
+	:return: The resident memory in kB, or None if it is not known.
+	"""
+	try:
+		with open('/proc/self/statm') as file:
+			return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+	except (OSError, ValueError, IndexError, AttributeError):
+		return None
+
+
+def reset_peak():
+	"""
+	Resets the high-water mark of the resident memory of the process, on Linux.
+	:return: Whether it could be reset.
+	"""
+	try:
+		with open('/proc/self/clear_refs', 'w') as file:
+			file.write('5')
+		return True
+	except OSError:
+		return False
+
+
+def peak_kb():
+	"""
+	Finds the high-water mark of the resident memory of the process, since it was last reset on Linux and since the
+	process started elsewhere.
+	:return: The high-water mark in kB, or None if it is not known.
+	"""
+	try:
+		with open('/proc/self/status') as file:
+			for line in file:
+				if line.startswith('VmHWM:'):
+					return int(line.split()[1])
+	except (OSError, ValueError, IndexError):
+		pass
+	return max_rss_kb(resource.RUSAGE_SELF) if resource is not None else None
+
+
+def max_rss_kb(who):
+	"""
+	Finds the largest resident memory since the start of the run with the resource module.
+	:param who: resource.RUSAGE_SELF or resource.RUSAGE_CHILDREN.
+	:return: The largest resident memory in kB, or None where the platform has no resource module.
+	"""
+	if resource is None:
+		return None
+	value = resource.getrusage(who).ru_maxrss
+	return value // 1024 if sys.platform == 'darwin' else value
+
+
+class Stage:
+	"""
+	Stores what is known about a running stage. The number of rows can be set while the stage runs.
+	"""
+	__slots__ = 'name', 'rows'
+
+	def __init__(self, name, rows=None):
+		self.name = name
+		self.rows = rows
+
+
+class Recorder:
+	"""
+	Stores the records of the stages that have finished, and writes each of them as a json line if asked to.
+	"""
+	__slots__ = 'records', 'output', 'profile_dir', 'trace_memory', 'peaks'
+
+	def __init__(self, output=None, profile_dir=None, trace_memory=False):
+		self.records = []
+		self.peaks = []
+		self.output = output
+		self.profile_dir = profile_dir
+		self.trace_memory = trace_memory
+		if profile_dir is not None:
+			os.makedirs(profile_dir, exist_ok=True)
+
+	@contextmanager
+	def stage(self, name, rows=None):
+		"""
+		Records a stage.
+		:param name: The name of the stage.
+		:param rows: The number of rows processed, if known in advance.
+		:return: The Stage, whose rows can be set before it ends.
+		"""
+		current = Stage(name, rows)
+		profile = cProfile.Profile() if self.profile_dir is not None else None
+		tracing = self.trace_memory and not tracemalloc.is_tracing()
+		if tracing:
+			tracemalloc.start()
+		rss = rss_kb()
+		if self.peaks:
+			self.peaks[-1] = max(self.peaks[-1], peak_kb() or 0)
+		scope = 'stage' if reset_peak() else 'process'
+		self.peaks.append(0)
+		wall = time.perf_counter()
+		cpu = time.process_time()
+		if profile is not None:
+			profile.enable()
+		try:
+			yield current
+		finally:
+			if profile is not None:
+				profile.disable()
+			record = {'stage': name, 'wall_seconds': time.perf_counter() - wall,
+					  'cpu_seconds': time.process_time() - cpu, 'rows': current.rows, 'rss_start_kb': rss,
+					  'rss_end_kb': rss_kb()}
+			peak = peak_kb()
+			nested = self.peaks.pop()
+			record['peak_rss_kb'] = None if peak is None else max(peak, nested)
+			record['peak_rss_scope'] = scope
+			if self.peaks and peak is not None:
+				self.peaks[-1] = max(self.peaks[-1], record['peak_rss_kb'])
+			record['children_max_rss_kb'] = max_rss_kb(resource.RUSAGE_CHILDREN) if resource is not None else None
+			if current.rows is not None and record['wall_seconds'] > 0:
+				record['rows_per_second'] = current.rows / record['wall_seconds']
+			if self.trace_memory:
+				record['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+			if tracing:
+				tracemalloc.stop()
+			if profile is not None:
+				record['profile'] = os.path.join(self.profile_dir, name.replace(' ', '_') + '.prof')
+				profile.dump_stats(record['profile'])
+			self.add(record)
+
+	def add(self, record):
+		"""
+		Adds a record and appends it to the output file.
+		:param record: The record.
+		:return: None.
+		"""
+		self.records.append(record)
+		if self.output is not None:
+			with open(self.output, 'a') as file:
+				file.write(json.dumps(record) + '\n')
+
+	def report(self):
+		"""
+		Formats the records as a table, with the peak memory allocated by every stage if it was traced.
+		:return: The table as a string.
+		"""
+		keys = ['rss_start_kb', 'rss_end_kb', 'peak_rss_kb', 'children_max_rss_kb']
+		titles = ['RSS IN (kB)', 'RSS OUT (kB)', 'PEAK (kB)', 'CHILD (kB)']
+		if self.trace_memory:
+			keys.append('peak_bytes')
+			titles.append('ALLOC (B)')
+		template = '%-20s %10s %10s %12s %14s' + ' %12s' * len(keys)
+		lines = [template % tuple(['STAGE', 'WALL (s)', 'CPU (s)', 'ROWS', 'ROWS/s'] + titles)]
+		for record in self.records:
+			lines.append(template % tuple([
+				record['stage'], '%.3f' % record['wall_seconds'], '%.3f' % record['cpu_seconds'],
+				'' if record['rows'] is None else record['rows'],
+				'%.0f' % record['rows_per_second'] if 'rows_per_second' in record else ''] +
+				['' if record.get(key) is None else record[key] for key in keys]))
+		return '\n'.join(lines)
+
+
+def enable(output=None, profile_dir=None, trace_memory=False):
+	"""
+	Starts recording every stage.
+	:param output: The json lines file the records are appended to. Default value is None, i.e. keep them in memory.
+	:param profile_dir: Profile every stage with cProfile and dump the profiles in this directory. Default value is
+	None, i.e. do not profile.
+	:param trace_memory: Record the peak memory allocated by every stage. Slows the stages down.
+	:return: The Recorder.
+	"""
+	global RECORDER
+	RECORDER = Recorder(output, profile_dir, trace_memory)
+	return RECORDER
+
+
+@contextmanager
+def stage(name, rows=None):
+	"""
+	Records a stage if recording was enabled, and does nothing otherwise.
+	:param name: The name of the stage.
+	:param rows: The number of rows processed, if known in advance.
+	:return: The Stage, whose rows can be set before it ends.
+	"""
+	if RECORDER is None:
+		yield Stage(name, rows)
+	else:
+		with RECORDER.stage(name, rows) as current:
+			yield current
+
+
+def timed(name=None):
+	"""
+	Records every call of a function as a stage.
+	:param name: The name of the stage. Default value is None, i.e. the name of the function.
+	:return: The decorator.
+	"""
+	def decorator(function):
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			with stage(name or function.__name__):
+				return function(*args, **kwargs)
+		return wrapper
+	return decorator
+
+
+def add_arguments(parser):
+	"""
+	Adds the options that enable recording to a command line parser.
+	:param parser: The argparse parser.
+	:return: None.
+	"""
+	parser.add_argument('--report', metavar='FILE', help='Time every stage and append the records to this json lines file.')
+	parser.add_argument('--profile', metavar='DIR', help='Time every stage and dump a cProfile profile of it here.')
+	parser.add_argument('--trace-memory', action='store_true',
+						help='Time every stage and record the peak memory it allocates. Slows the stages down.')
+
+
+def enable_from(args):
+	"""
+	Enables recording if one of the options added by add_arguments was given.
+	:param args: The parsed arguments.
+	:return: The Recorder, or None.
+	"""
+	if args.report is None and args.profile is None and not args.trace_memory:
+		return None
+	return enable(args.report, args.profile, args.trace_memory)
@@ -0,0 +1,106 @@
+"""
+Picks the best model of the classifier sweeps, trains it and saves it together with the schema of the features it
+expects, so that new collisions can be scored without training again. Model files are pickles, so only load the ones
+you made.
+"""
+import pickle
+import sklearn
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.ensemble import RandomForestClassifier
+import numpy as np
+
+FEATURES = ['DATE', 'TIME', 'BOROUGH', 'LATITUDE', 'LONGITUDE']
+CLASSES = ['Safe', 'Injured', 'Killed']
+PARAMETERS = {'knn': 'k', 'random_forest': 'n_estimators'}
+VERSION = 1
+
+
+def sweep_rows(model, values, accuracy, split, seed=None):
+	"""
+	Turns the accuracies of a sweep into result rows.
+	:param model: The name of the model, 'knn' or 'random_forest'.
+	:param values: The list of hyperparameter values.
+	:param accuracy: The list of accuracies for each value.
+	:param split: The fraction of the rows used for training.
+	:param seed: The random seed. Default value is None.
+	:return: A list of result rows.
+	"""
+	return [{'model': model, 'split': split, 'seed': seed, 'parameter': PARAMETERS[model], 'value': value,
+			 'accuracy': acc} for value, acc in zip(values, accuracy)]
+
+
+def best(results):
+	"""
+	Finds the most accurate model of the sweeps. Ties go to the first row, i.e. the smaller k or forest.
+	:param results: The list of result rows.
+	:return: The best row.
+	"""
+	return max(results, key=lambda row: row['accuracy'])
+
+
+def build(model, value, seed=None):
+	"""
+	Creates an untrained model.
+	:param model: The name of the model, 'knn' or 'random_forest'.
+	:param value: The value of its hyperparameter.
+	:param seed: The random seed of a forest. Default value is None.
+	:return: The sklearn classifier.
+	"""
+	if model == 'knn':
+		return KNeighborsClassifier(n_neighbors=value)
+	if model == 'random_forest':
+		return RandomForestClassifier(n_estimators=value, random_state=seed)
+	raise ValueError('Unknown model ' + model)
+
+
+def train(data, classes, row):
+	"""
+	Trains the model of a result row on all of the data.
+	:param data: The data.
+	:param classes: A list of classes.
+	:param row: The result row.
+	:return: The trained classifier and its schema.
+	"""
+	classifier = build(row['model'], row['value'], row['seed'])
+	classifier.fit(np.asarray(data, dtype=np.float64), np.asarray(classes))
+	schema = {'version': VERSION, 'features': FEATURES, 'classes': [int(label) for label in classifier.classes_],
+			  'model': row['model'], 'parameter': row['parameter'], 'value': row['value'], 'seed': row['seed'],
+			  'split': row['split'], 'accuracy': row['accuracy'], 'rows': len(data), 'sklearn': sklearn.__version__}
+	return classifier, schema
+
+
+def save(file_name, classifier, schema):
+	"""
+	Saves a trained model with its schema.
+	:param file_name: The name of the file.
+	:param classifier: The trained classifier.
+	:param schema: The schema.
+	:return: None.
+	"""
+	with open(file_name, 'wb') as file:
+		pickle.dump({'schema': schema, 'model': classifier}, file, pickle.HIGHEST_PROTOCOL)
+
+
+def load(file_name):
+	"""
+	Loads a model saved by save, checking that it expects the features this code builds.
+	:param file_name: The name of the file.
+	:return: The classifier and its schema.
+	"""
+	with open(file_name, 'rb') as file:
+		saved = pickle.load(file)
+	schema = saved['schema']
+	if schema.get('version') != VERSION or schema.get('features') != FEATURES:
+		raise ValueError(file_name + ' was saved for other features: ' + str(schema.get('features')))
+	return saved['model'], schema
+
+
+def describe(schema):
+	"""
+	Describes a saved model in one line.
+	:param schema: The schema.
+	:return: The description.
+	"""
+	return schema['model'] + ' with ' + schema['parameter'] + ' = ' + str(schema['value']) + ', accuracy ' +\
+		   str(round(schema['accuracy'], 4)) + ' at split ' + str(schema['split']) + ', trained on ' +\
+		   str(schema['rows']) + ' rows'
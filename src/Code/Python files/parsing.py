@@ -0,0 +1,66 @@
+"""
+Parsing of the date and time fields shared by every Incident. The dataset only has a few thousand distinct dates and
+1440 distinct times, so every parse is cached and repeated values cost a single dictionary lookup.
+"""
+import datetime as dt
+from functools import lru_cache
+
+DATE_CACHE_SIZE = 1 << 16
+TIME_CACHE_SIZE = 1 << 12
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def find_date(date):
+	"""
+	Parses a date in any of the formats found in the data: 'YYYY-MM-DD', 'MM/DD/YYYY' or 'MM-DD-YY'.
+	:param date: The date as a string.
+	:return: The date.
+	"""
+	if '/' in date:
+		return dt.datetime.strptime(date, '%m/%d/%Y').date()
+	if len(date) == 10 and date[4] == '-':
+		return dt.date.fromisoformat(date)
+	return dt.datetime.strptime(date, '%m-%d-%y').date()
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def find_day(date):
+	"""
+	Finds the day of the week on which a date falls.
+	:param date: The date as a string.
+	:return: The day of the week, 0 being Monday.
+	"""
+	return find_date(date).weekday()
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def find_ordinal(date):
+	"""
+	Finds the proleptic Gregorian ordinal of a date, i.e. the number of days since 0001-01-01 plus one.
+	:param date: The date as a string.
+	:return: The ordinal.
+	"""
+	return find_date(date).toordinal()
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def format_date(ordinal):
+	"""
+	Writes the date of an ordinal as 'YYYY-MM-DD'.
+	:param ordinal: The ordinal.
+	:return: The date as a string.
+	"""
+	return dt.date.fromordinal(ordinal).isoformat()
+
+
+@lru_cache(maxsize=TIME_CACHE_SIZE)
+def find_time(time):
+	"""
+	Finds the hour of the day of a time.
+	:param time: The time as a string, either 'HH:MM' or just the hour.
+	:return: The hour.
+	"""
+	hour = int(time.split(':')[0])
+	if not 0 <= hour < 24:
+		raise ValueError('Hour out of range: ' + time)
+	return hour
@@ -0,0 +1,156 @@
+"""
+Scores a csv file of new collisions with a model saved by classifier.py or experiments.py. The file is read in chunks
+and the chunks are predicted in a pool of worker processes that each load the model once, with only a few chunks in
+flight at a time so that memory stays bounded however large the file is.
+"""
+import argparse
+from collections import deque
+import multiprocessing as mp
+import numpy as np
+import build_features
+import csv_parser
+import fileio
+import instrument
+import model
+
+CHUNK_SIZE = 50000
+INPUT = ['id', 'date', 'time', 'borough', 'latitude', 'longitude']
+COLUMNS = [column for column in build_features.COLUMNS if column.name in INPUT]
+
+_classifier = None
+_schema = None
+
+
+def init_worker(model_file):
+	"""
+	Loads the model in the worker process once instead of sending it with every chunk.
+	:param model_file: The name of the model file.
+	:return: None.
+	"""
+	global _classifier, _schema
+	_classifier, _schema = model.load(model_file)
+
+
+def features(fields):
+	"""
+	Builds the features the models are trained on from the fields of a chunk of collisions.
+	:param fields: The dictionary of an array for every column.
+	:return: The array of features, one row per collision, in the order of model.FEATURES.
+	"""
+	return np.column_stack([(fields['date'] - 1) % 7, fields['time'], fields['borough'], fields['latitude'],
+							fields['longitude']]).astype(np.float64)
+
+
+def read_chunks(file, chunk_size=CHUNK_SIZE, quarantine=None):
+	"""
+	Lazily reads the collisions to score.
+	:param file: File handler
+	:param chunk_size: The maximum number of collisions in a chunk.
+	:param quarantine: The csv_parser.Quarantine to put unreadable rows in. Default value is None.
+	:return: A generator of (ids, features) chunks.
+	"""
+	for fields in csv_parser.Parser(file, COLUMNS, quarantine=quarantine).chunks(chunk_size):
+		yield fields['id'], features(fields)
+
+
+def predict_chunk(chunk, probabilities=False):
+	"""
+	Predicts the safety class of a chunk of collisions with the loaded model.
+	:param chunk: The (ids, features) chunk.
+	:param probabilities: Whether to also give the probability of every class. Default value is False.
+	:return: The csv rows of the predictions.
+	"""
+	ids, data = chunk
+	if len(ids) == 0:
+		return ''
+	if probabilities:
+		proba = _classifier.predict_proba(data)
+		predicted = _classifier.classes_[proba.argmax(axis=1)]
+		rows = np.column_stack([ids, predicted, proba]).tolist()
+		return ''.join('%d,%d' % (row[0], row[1]) + ''.join(',%.4f' % p for p in row[2:]) + '\n' for row in rows)
+	predicted = _classifier.predict(data)
+	return ''.join('%d,%d\n' % row for row in zip(ids.tolist(), predicted.tolist()))
+
+
+def header(schema, probabilities=False):
+	"""
+	Builds the header of the predictions file.
+	:param schema: The schema of the model.
+	:param probabilities: Whether the probability of every class is written. Default value is False.
+	:return: The header line.
+	"""
+	names = ['ID', 'CLASS']
+	if probabilities:
+		names += ['P_' + model.CLASSES[label].upper() for label in schema['classes']]
+	return ','.join(names) + '\n'
+
+
+def predict_file(model_file, file_in, file_out, chunk_size=CHUNK_SIZE, workers=1, probabilities=False,
+				 quarantine=None):
+	"""
+	Scores every collision of a file and writes the predictions in the original row order.
+	:param model_file: The name of the model file.
+	:param file_in: The file to read.
+	:param file_out: The file to write.
+	:param chunk_size: The maximum number of collisions in a chunk.
+	:param workers: The number of worker processes. Default value is 1, i.e. predict in this process.
+	:param probabilities: Whether to also write the probability of every class. Default value is False.
+	:param quarantine: The csv_parser.Quarantine to put unreadable rows in. Default value is None.
+	:return: The number of collisions scored.
+	"""
+	init_worker(model_file)
+	file_out.write(header(_schema, probabilities))
+	count = 0
+	chunks = read_chunks(file_in, chunk_size, quarantine)
+	if workers <= 1:
+		for chunk in chunks:
+			file_out.write(predict_chunk(chunk, probabilities))
+			count += len(chunk[0])
+		return count
+	with mp.Pool(workers, initializer=init_worker, initargs=(model_file,)) as pool:
+		pending = deque()
+		for chunk in chunks:
+			pending.append(pool.apply_async(predict_chunk, (chunk, probabilities)))
+			count += len(chunk[0])
+			if len(pending) > 2 * workers:
+				file_out.write(pending.popleft().get())
+		while pending:
+			file_out.write(pending.popleft().get())
+	return count
+
+
+def parse_args():
+	"""
+	Parses the command line arguments.
+	:return: The arguments.
+	"""
+	parser = argparse.ArgumentParser(description='Predicts the safety class of new collisions with a saved model.')
+	parser.add_argument('model', help='The model file saved with --save.')
+	parser.add_argument('input', help='The collisions to score, in the format of the raw data.')
+	parser.add_argument('--output', default='predictions.csv', help='The predictions file, may end in .gz or .zst.')
+	parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='The number of rows predicted at once.')
+	parser.add_argument('--workers', type=int, default=1, help='The number of worker processes.')
+	parser.add_argument('--probabilities', action='store_true', help='Also write the probability of every class.')
+	instrument.add_arguments(parser)
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	recorder = instrument.enable_from(args)
+	quarantine = csv_parser.Quarantine()
+	file_in = fileio.open_file(args.input, 'r')
+	file_out = fileio.open_file(args.output, 'w')
+	with instrument.stage('predict') as stage:
+		stage.rows = predict_file(args.model, file_in, file_out, args.chunk_size, args.workers, args.probabilities,
+								  quarantine)
+	file_in.close()
+	file_out.close()
+	print('predicted', stage.rows, 'rows with', model.describe(_schema))
+	if quarantine.total() > 0:
+		print(quarantine)
+	if recorder is not None:
+		print(recorder.report())
+
+if __name__ == '__main__':
+	main()
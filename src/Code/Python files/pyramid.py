@@ -0,0 +1,309 @@
+"""
+A density pyramid of the collisions: 2D histograms over the NYC bounding box at several zoom levels, level L having
+2^L x 2^L bins, kept for every day, hour, borough and class. Only the bins that hold collisions are stored, as one
+sorted key per (group, bin) with its count, so a map or heatmap of any borough/day/hour filter is a sum over the
+cached bins instead of a plot of every row. The pyramid is kept next to the classified csv file and rebuilt when that
+file changes.
+"""
+import argparse
+import os
+import numpy as np
+from matplotlib import pyplot as plt
+import aggregate
+import build_features
+import classifier
+import dataset_cache
+
+LEVELS = [6, 7, 8, 9]
+LEVEL = 8
+MARKER_SIZE = 40
+
+
+def pyramid_path(file_name):
+	"""
+	Finds the name of the pyramid file kept next to a classified csv file.
+	:param file_name: The name of the csv file.
+	:return: The name of the pyramid file.
+	"""
+	return os.path.splitext(file_name)[0] + '.pyramid.npz'
+
+
+def selection(values, size):
+	"""
+	Turns a filter into a mask over the values of a dimension.
+	:param values: None for every value, a single value or a list of values.
+	:param size: The number of values of the dimension.
+	:return: The boolean mask.
+	"""
+	if values is None:
+		return np.ones(size, dtype=bool)
+	mask = np.zeros(size, dtype=bool)
+	mask[np.atleast_1d(values)] = True
+	return mask
+
+
+class DensityPyramid:
+	"""
+	Stores, for every level, the sorted keys group * 4^level + bin of the bins holding collisions and their counts,
+	the group being aggregate.group_key of the day, hour, borough and class.
+	"""
+	__slots__ = 'levels', 'keys', 'counts', 'outside'
+
+	def __init__(self, levels=tuple(LEVELS)):
+		self.levels = list(levels)
+		self.keys = {level: np.zeros(0, dtype=np.int64) for level in self.levels}
+		self.counts = {level: np.zeros(0, dtype=np.int64) for level in self.levels}
+		self.outside = 0
+
+	@classmethod
+	def from_data(cls, data, levels=tuple(LEVELS)):
+		"""
+		Builds the pyramid of some data.
+		:param data: The data as IncidentColumns.
+		:param levels: The zoom levels.
+		:return: The pyramid.
+		"""
+		pyramid = cls(levels)
+		pyramid.update(data.day, data.time_class, data.borough, data.safety_class, data.latitude, data.longitude)
+		return pyramid
+
+	@classmethod
+	def from_file(cls, file_name, levels=tuple(LEVELS)):
+		"""
+		Builds the pyramid of a classified csv file.
+		:param file_name: The name of the file.
+		:param levels: The zoom levels.
+		:return: The pyramid.
+		"""
+		attrs, data, classes = classifier.load_data(file_name)
+		columns = [data[:, attrs.index(name)] for name in ('DATE', 'TIME', 'BOROUGH', 'LATITUDE', 'LONGITUDE')]
+		pyramid = cls(levels)
+		pyramid.update(*[column.astype(np.int64) for column in columns[:3]], np.asarray(classes, dtype=np.int64),
+					   columns[3], columns[4])
+		return pyramid
+
+	@classmethod
+	def load(cls, file_name):
+		"""
+		Loads a pyramid written by save.
+		:param file_name: The name of the pyramid file.
+		:return: The pyramid.
+		"""
+		with np.load(file_name) as file:
+			pyramid = cls(file['levels'].tolist())
+			for level in pyramid.levels:
+				pyramid.keys[level] = file['keys_' + str(level)]
+				pyramid.counts[level] = file['counts_' + str(level)]
+			pyramid.outside = int(file['outside'])
+		return pyramid
+
+	def save(self, file_name, source=None):
+		"""
+		Writes the pyramid to a file.
+		:param file_name: The name of the pyramid file.
+		:param source: The name of the csv file it was built from, to tell when it is stale. Default value is None.
+		:return: None.
+		"""
+		arrays = {'levels': np.array(self.levels), 'outside': np.array(self.outside)}
+		if source is not None:
+			key = dataset_cache.source_key(source)
+			arrays['source'] = np.array([key['size'], key['mtime']], dtype=np.int64)
+		for level in self.levels:
+			arrays['keys_' + str(level)] = self.keys[level]
+			arrays['counts_' + str(level)] = self.counts[level]
+		with open(file_name, 'wb') as file:
+			np.savez(file, **arrays)
+
+	def update(self, day, hour, borough, safety_class, latitude, longitude):
+		"""
+		Adds collisions to every level. Collisions outside the bounding box are only counted.
+		:param day: The array of days.
+		:param hour: The array of hours.
+		:param borough: The array of boroughs.
+		:param safety_class: The array of classes.
+		:param latitude: The array of latitudes.
+		:param longitude: The array of longitudes.
+		:return: None.
+		"""
+		finest = 1 << max(self.levels)
+		row = np.floor((np.asarray(latitude) - aggregate.SOUTH) / (aggregate.NORTH - aggregate.SOUTH) * finest).astype(np.int64)
+		col = np.floor((np.asarray(longitude) - aggregate.WEST) / (aggregate.EAST - aggregate.WEST) * finest).astype(np.int64)
+		inside = (row >= 0) & (row < finest) & (col >= 0) & (col < finest)
+		self.outside += int(np.count_nonzero(~inside))
+		group = aggregate.group_key(np.asarray(day)[inside], np.asarray(hour)[inside], np.asarray(borough)[inside],
+									np.asarray(safety_class)[inside]).astype(np.int64)
+		row = row[inside]
+		col = col[inside]
+		for level in self.levels:
+			shift = max(self.levels) - level
+			key = (group << (2 * level)) + ((row >> shift) << level) + (col >> shift)
+			keys, inverse = np.unique(np.concatenate([self.keys[level], key]), return_inverse=True)
+			weights = np.concatenate([self.counts[level], np.ones(len(key), dtype=np.int64)])
+			self.keys[level] = keys
+			self.counts[level] = np.bincount(inverse, weights, minlength=len(keys)).astype(np.int64)
+
+	def density(self, level=LEVEL, day=None, hour=None, borough=None, safety_class=None):
+		"""
+		Sums the bins of the collisions matching a filter. Every filter is None for all values, a single value or a
+		list of values.
+		:param level: The zoom level.
+		:param day: The days.
+		:param hour: The hours.
+		:param borough: The boroughs.
+		:param safety_class: The classes.
+		:return: The counts as an array of shape (classes, 2^level, 2^level), row 0 being the south.
+		"""
+		groups = selection(day, aggregate.N_DAYS)[:, None, None, None] & \
+				 selection(hour, aggregate.N_HOURS)[None, :, None, None] & \
+				 selection(borough, aggregate.N_BOROUGHS)[None, None, :, None] & \
+				 selection(safety_class, aggregate.N_CLASSES)[None, None, None, :]
+		keys = self.keys[level]
+		group = keys >> (2 * level)
+		mask = groups.ravel()[group]
+		size = 1 << (2 * level)
+		key = (group[mask] % aggregate.N_CLASSES) * size + (keys[mask] & (size - 1))
+		counts = np.bincount(key, self.counts[level][mask], minlength=aggregate.N_CLASSES * size)
+		return counts.astype(np.int64).reshape(aggregate.N_CLASSES, 1 << level, 1 << level)
+
+	def centers(self, level=LEVEL):
+		"""
+		Finds the coordinates of the centers of the bins of a level.
+		:param level: The zoom level.
+		:return: The arrays of the latitudes of the rows and the longitudes of the columns.
+		"""
+		steps = (np.arange(1 << level) + .5) / (1 << level)
+		return aggregate.SOUTH + steps * (aggregate.NORTH - aggregate.SOUTH), aggregate.WEST + steps * (aggregate.EAST - aggregate.WEST)
+
+
+def load_pyramid(file_name, levels=tuple(LEVELS)):
+	"""
+	Loads the pyramid of a classified csv file, building it when it is missing or stale.
+	:param file_name: The name of the csv file.
+	:param levels: The zoom levels to build it with.
+	:return: The pyramid.
+	"""
+	path = pyramid_path(file_name)
+	key = dataset_cache.source_key(file_name)
+	try:
+		with np.load(path) as file:
+			fresh = 'source' in file and file['source'].tolist() == [key['size'], key['mtime']]
+		if fresh:
+			return DensityPyramid.load(path)
+	except (OSError, ValueError):
+		pass
+	pyramid = DensityPyramid.from_file(file_name, levels)
+	pyramid.save(path, file_name)
+	return pyramid
+
+
+def find_name(day=None, hour=None, borough=None):
+	"""
+	Names the map of a filter.
+	:param day: The day, or None.
+	:param hour: The hour, or None.
+	:param borough: The borough, or None.
+	:return: The name.
+	"""
+	parts = [build_features.BOROUGHS[borough] if borough is not None else '',
+			 build_features.DAYS[day] if day is not None else '', str(hour) + 'H' if hour is not None else '']
+	return ' '.join(part for part in parts if part != '') or 'ALL'
+
+
+def draw_map(pyramid, name='ALL', level=LEVEL, **filters):
+	"""
+	Draws a map of the collisions like build_features.draw_map, with a marker for every bin holding collisions of a
+	class instead of one for every collision. The markers grow with the number of collisions in the bin.
+	:param pyramid: The DensityPyramid.
+	:param name: The name of the map. Default value is 'ALL'.
+	:param level: The zoom level. Default value is LEVEL.
+	:param filters: The day, hour and borough filters of DensityPyramid.density.
+	:return: None.
+	"""
+	density = pyramid.density(level, **filters)
+	latitude, longitude = pyramid.centers(level)
+	plt.figure(name, (20, 20))
+	plt.title(name)
+	largest = max(int(density.max()), 1)
+	for safety_class in range(len(build_features.CLASSES)):
+		rows, cols = np.nonzero(density[safety_class])
+		if len(rows) > 0:
+			plt.scatter(longitude[cols], latitude[rows], MARKER_SIZE * np.sqrt(density[safety_class, rows, cols] / largest),
+						build_features.MARKERS[safety_class][0], label=build_features.CLASSES[safety_class])
+	plt.xlim(aggregate.WEST, aggregate.EAST)
+	plt.ylim(aggregate.SOUTH, aggregate.NORTH)
+	if density.any():
+		plt.legend(loc='upper right')
+	plt.gca().set_aspect('equal', adjustable='box')
+	build_features.show(name)
+
+
+def draw_heatmap(pyramid, name='ALL', level=LEVEL, safety_class=None, **filters):
+	"""
+	Draws the density of the collisions as a heatmap on a log scale.
+	:param pyramid: The DensityPyramid.
+	:param name: The name of the map. Default value is 'ALL'.
+	:param level: The zoom level. Default value is LEVEL.
+	:param safety_class: Only count the collisions of these classes. Default value is None, i.e. all of them.
+	:param filters: The day, hour and borough filters of DensityPyramid.density.
+	:return: None.
+	"""
+	density = pyramid.density(level, safety_class=safety_class, **filters).sum(axis=0)
+	plt.figure(name + ' HEATMAP', (20, 20))
+	plt.title(name + ' HEATMAP')
+	plt.imshow(np.ma.masked_equal(density, 0), origin='lower', extent=(aggregate.WEST, aggregate.EAST, aggregate.SOUTH, aggregate.NORTH), norm='log',
+			   interpolation='nearest')
+	plt.colorbar(label='COUNT')
+	plt.gca().set_aspect('equal', adjustable='box')
+	build_features.show(name + ' HEATMAP')
+
+
+def draw_all(pyramid, level=LEVEL, heatmap=False):
+	"""
+	Draws the maps build_features draws, for every borough, all the data and every day, from the pyramid.
+	:param pyramid: The DensityPyramid.
+	:param level: The zoom level. Default value is LEVEL.
+	:param heatmap: Draw heatmaps instead of maps. Default value is False.
+	:return: None.
+	"""
+	draw = draw_heatmap if heatmap else draw_map
+	for borough in range(len(build_features.BOROUGHS)):
+		draw(pyramid, build_features.BOROUGHS[borough], level, borough=borough)
+	draw(pyramid, 'ALL', level)
+	for day in range(len(build_features.DAYS)):
+		draw(pyramid, build_features.DAYS[day], level, day=day)
+
+
+def parse_args():
+	"""
+	Parses the command line arguments.
+	:return: The arguments.
+	"""
+	parser = argparse.ArgumentParser(description='Draws collision maps and heatmaps from the density pyramid.')
+	parser.add_argument('--input', default='clean_classified.csv', help='The classified collisions file.')
+	parser.add_argument('--level', type=int, default=LEVEL, choices=LEVELS, help='The zoom level.')
+	parser.add_argument('--borough', choices=build_features.BOROUGHS, help='Only draw this borough.')
+	parser.add_argument('--day', choices=build_features.DAYS, help='Only draw this day of the week.')
+	parser.add_argument('--hour', type=int, choices=range(aggregate.N_HOURS), help='Only draw this hour.')
+	parser.add_argument('--heatmap', action='store_true', help='Draw a heatmap instead of a map.')
+	parser.add_argument('--all', action='store_true', help='Draw the maps of every borough and day.')
+	parser.add_argument('--out-dir', help='Write every figure to this directory instead of showing it.')
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	if args.out_dir is not None:
+		build_features.set_output(args.out_dir)
+	pyramid = load_pyramid(args.input)
+	if pyramid.outside > 0:
+		print(pyramid.outside, 'collisions are outside the NYC bounding box')
+	if args.all:
+		draw_all(pyramid, args.level, args.heatmap)
+		return
+	filters = {'day': None if args.day is None else build_features.DAYS.index(args.day), 'hour': args.hour,
+			   'borough': None if args.borough is None else build_features.BOROUGHS.index(args.borough)}
+	draw = draw_heatmap if args.heatmap else draw_map
+	draw(pyramid, find_name(**filters), args.level, **filters)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,275 @@
+"""
+Serves a model saved by classifier.py over HTTP on localhost. Concurrent requests are queued and predicted together in
+micro-batches with a single predict_proba call, and the latency of every request is kept to report its percentiles.
+
+	POST /predict	{"day": "FRIDAY", "hour": 18, "borough": "BROOKLYN", "latitude": 40.65, "longitude": -73.95}
+					or a list of such objects
+	GET /stats		the latency percentiles and the batch sizes
+"""
+import argparse
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import queue
+import threading
+import time
+import numpy as np
+import model
+
+DAYS = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY']
+BOROUGHS = ['MANHATTAN', 'BRONX', 'QUEENS', 'BROOKLYN', 'STATEN ISLAND']
+HOST = '127.0.0.1'
+PORT = 8017
+MAX_BATCH = 256
+MAX_WAIT = 0.002
+HISTORY = 10000
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def find_index(value, names, size):
+	"""
+	Finds the index of a day or borough given either by its name or by its index.
+	:param value: The name or the index.
+	:param names: The list of names.
+	:param size: The number of indexes.
+	:return: The index.
+	"""
+	if isinstance(value, str) and not value.strip().isdigit():
+		return names.index(value.strip().upper())
+	index = int(value)
+	if not 0 <= index < size:
+		raise ValueError(str(value) + ' is out of range')
+	return index
+
+
+def features(query):
+	"""
+	Builds the features of a single query in the order of model.FEATURES.
+	:param query: The dictionary with the day, hour, borough, latitude and longitude.
+	:return: The list of features.
+	"""
+	try:
+		hour = int(query['hour'])
+		if not 0 <= hour < 24:
+			raise ValueError('hour ' + str(hour) + ' is out of range')
+		latitude = float(query['latitude'])
+		longitude = float(query['longitude'])
+		if not (math.isfinite(latitude) and math.isfinite(longitude)):
+			raise ValueError('latitude and longitude must be finite numbers')
+		return [find_index(query['day'], DAYS, 7), hour, find_index(query['borough'], BOROUGHS, 5), latitude, longitude]
+	except KeyError as error:
+		raise ValueError('missing ' + str(error))
+
+
+class Latencies:
+	"""
+	Keeps the latencies of the latest requests and the sizes of the latest batches.
+	"""
+	__slots__ = 'latencies', 'batches', 'total', 'lock'
+
+	def __init__(self, size=HISTORY):
+		self.latencies = deque(maxlen=size)
+		self.batches = deque(maxlen=size)
+		self.total = 0
+		self.lock = threading.Lock()
+
+	def add(self, seconds):
+		with self.lock:
+			self.latencies.append(seconds)
+			self.total += 1
+
+	def add_batch(self, size):
+		with self.lock:
+			self.batches.append(size)
+
+	def report(self):
+		"""
+		Summarizes the latencies.
+		:return: The dictionary of the number of requests, the latency percentiles in milliseconds and the mean batch
+		size.
+		"""
+		with self.lock:
+			latencies = np.array(self.latencies) * 1000
+			batches = np.array(self.batches)
+			total = self.total
+		stats = {'requests': total, 'batches': len(batches),
+				 'mean_batch': round(float(batches.mean()), 2) if len(batches) > 0 else 0}
+		for p in PERCENTILES:
+			stats['p' + str(p) + '_ms'] = round(float(np.percentile(latencies, p)), 3) if len(latencies) > 0 else 0
+		return stats
+
+
+class Batcher(threading.Thread):
+	"""
+	Predicts the queued queries in micro-batches. A batch is closed when it holds max_batch queries or when max_wait
+	seconds have passed since its first query, so a lone request waits at most max_wait.
+	"""
+
+	def __init__(self, classifier, max_batch=MAX_BATCH, max_wait=MAX_WAIT, latencies=None):
+		super().__init__(daemon=True)
+		self.classifier = classifier
+		self.max_batch = max_batch
+		self.max_wait = max_wait
+		self.latencies = Latencies() if latencies is None else latencies
+		self.queue = queue.Queue()
+
+	def submit(self, rows):
+		"""
+		Queues the features of some queries.
+		:param rows: The list of feature lists.
+		:return: A Future of the array of class probabilities, one row per query.
+		"""
+		future = Future()
+		self.queue.put((rows, future))
+		return future
+
+	def collect(self):
+		"""
+		Waits for the next batch of queries.
+		:return: The list of (rows, future) of the batch.
+		"""
+		batch = [self.queue.get()]
+		size = len(batch[0][0])
+		deadline = time.perf_counter() + self.max_wait
+		while size < self.max_batch:
+			remaining = deadline - time.perf_counter()
+			try:
+				item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+			except queue.Empty:
+				break
+			batch.append(item)
+			size += len(item[0])
+		return batch
+
+	def predict(self, batch):
+		"""
+		Predicts a batch of queries at once, and if that fails, every request of the batch on its own so that one bad
+		request does not fail the others.
+		:param batch: The list of (rows, future) of the batch.
+		:return: None.
+		"""
+		rows = [row for item, future in batch for row in item]
+		try:
+			proba = self.classifier.predict_proba(np.array(rows, dtype=np.float64))
+		except Exception as error:
+			if len(batch) == 1:
+				batch[0][1].set_exception(error)
+			else:
+				for item in batch:
+					self.predict([item])
+			return
+		self.latencies.add_batch(len(rows))
+		start = 0
+		for item, future in batch:
+			future.set_result(proba[start:start + len(item)])
+			start += len(item)
+
+	def run(self):
+		while True:
+			self.predict(self.collect())
+
+
+class Handler(BaseHTTPRequestHandler):
+	"""
+	Answers the requests with the batcher and the schema of the server.
+	"""
+
+	def reply(self, status, body):
+		data = json.dumps(body).encode()
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_GET(self):
+		if self.path == '/stats':
+			self.reply(200, self.server.batcher.latencies.report())
+		elif self.path == '/model':
+			self.reply(200, self.server.schema)
+		else:
+			self.reply(404, {'error': 'unknown path ' + self.path})
+
+	def do_POST(self):
+		start = time.perf_counter()
+		if self.path != '/predict':
+			self.reply(404, {'error': 'unknown path ' + self.path})
+			return
+		try:
+			body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+			queries = body if isinstance(body, list) else [body]
+			rows = [features(query) for query in queries]
+			if not rows:
+				raise ValueError('no queries')
+		except (ValueError, TypeError, AttributeError) as error:
+			self.reply(400, {'error': str(error)})
+			return
+		try:
+			proba = self.server.batcher.submit(rows).result()
+		except Exception as error:
+			self.reply(500, {'error': 'prediction failed: ' + str(error)})
+			return
+		answers = [self.server.answer(p) for p in proba.tolist()]
+		self.reply(200, answers if isinstance(body, list) else answers[0])
+		self.server.batcher.latencies.add(time.perf_counter() - start)
+
+	def log_message(self, format, *args):
+		pass
+
+
+class Server(ThreadingHTTPServer):
+	"""
+	The HTTP server, holding the model warm in memory for all the requests.
+	"""
+	daemon_threads = True
+
+	def __init__(self, address, classifier, schema, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+		super().__init__(address, Handler)
+		self.schema = schema
+		self.names = [model.CLASSES[label] for label in schema['classes']]
+		self.batcher = Batcher(classifier, max_batch, max_wait)
+		self.batcher.start()
+
+	def answer(self, proba):
+		"""
+		Builds the answer to a single query.
+		:param proba: The list of the probabilities of the classes.
+		:return: The dictionary of the predicted class, the probability of every class and the probability of an
+		injury or a fatality.
+		"""
+		probabilities = dict(zip(self.names, proba))
+		return {'class': self.names[int(np.argmax(proba))], 'probabilities': probabilities,
+				'injury_or_fatality': 1 - probabilities.get('Safe', 0)}
+
+
+def parse_args():
+	"""
+	Parses the command line arguments.
+	:return: The arguments.
+	"""
+	parser = argparse.ArgumentParser(description='Serves a saved model over HTTP on localhost.')
+	parser.add_argument('model', help='The model file saved with --save.')
+	parser.add_argument('--host', default=HOST, help='The address to listen on.')
+	parser.add_argument('--port', type=int, default=PORT, help='The port to listen on.')
+	parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help='The largest number of queries in a batch.')
+	parser.add_argument('--max-wait', type=float, default=MAX_WAIT * 1000,
+						help='How long a batch waits for more queries, in milliseconds.')
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	classifier, schema = model.load(args.model)
+	server = Server((args.host, args.port), classifier, schema, args.max_batch, args.max_wait / 1000)
+	print('serving', model.describe(schema), 'on http://' + args.host + ':' + str(server.server_port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	server.server_close()
+	print(server.batcher.latencies.report())
+
+if __name__ == '__main__':
+	main()
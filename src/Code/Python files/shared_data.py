@@ -0,0 +1,127 @@
+"""
+Puts NumPy arrays in a single block of shared memory so that worker processes can read the dataset without each one
+receiving and holding a pickled copy of it. The process that shares the arrays owns the block and removes it when it
+is closed, or at exit at the latest; workers attach to it by name and only ever read it.
+
+	with shared_data.share({'data': data, 'classes': classes}) as shared:
+		with mp.Pool(workers, initializer=init_worker, initargs=(shared.descriptor,)) as pool:
+			...
+
+	def init_worker(descriptor):
+		arrays = shared_data.attach(descriptor)
+"""
+import atexit
+import os
+from multiprocessing import shared_memory
+import numpy as np
+
+ALIGNMENT = 64
+
+_owned = {}
+_attached = {}
+
+
+class SharedDataset:
+	"""
+	Named arrays laid out one after the other in a block of shared memory.
+	"""
+	__slots__ = 'memory', 'layout', 'arrays', 'owner'
+
+	def __init__(self, memory, layout, owner):
+		"""
+		:param memory: The SharedMemory block.
+		:param layout: The list of (name, dtype, shape, offset) of the arrays.
+		:param owner: Whether this process made the block and must remove it.
+		"""
+		self.memory = memory
+		self.layout = layout
+		self.owner = os.getpid() if owner else None
+		self.arrays = {name: np.ndarray(shape, np.dtype(dtype), memory.buf, offset)
+					   for name, dtype, shape, offset in layout}
+		if not owner:
+			for array in self.arrays.values():
+				array.flags.writeable = False
+
+	@property
+	def descriptor(self):
+		"""
+		Describes the block so that another process can attach to it.
+		:return: The (name of the block, layout) pair, which is small and can be pickled.
+		"""
+		return self.memory.name, self.layout
+
+	def __getitem__(self, name):
+		return self.arrays[name]
+
+	def close(self):
+		"""
+		Detaches from the block, removing it if this process owns it. The arrays must not be used afterwards.
+		:return: None.
+		"""
+		if self.memory is None:
+			return
+		self.arrays = {}
+		name = self.memory.name
+		try:
+			self.memory.close()
+		except BufferError:
+			pass
+		if self.owner == os.getpid():
+			self.memory.unlink()
+		if self.owner is None:
+			_attached.pop(name, None)
+		else:
+			_owned.pop(name, None)
+		self.memory = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+def share(arrays):
+	"""
+	Copies arrays into a new block of shared memory, every array starting on a cache line.
+	:param arrays: The dictionary of arrays.
+	:return: The SharedDataset, owned by this process.
+	"""
+	layout = []
+	size = 0
+	for name, array in arrays.items():
+		array = np.asarray(array)
+		size = -(-size // ALIGNMENT) * ALIGNMENT
+		layout.append((name, array.dtype.str, array.shape, size))
+		size += array.nbytes
+	memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+	shared = SharedDataset(memory, layout, True)
+	for name, array in arrays.items():
+		shared.arrays[name][...] = array
+	_owned[memory.name] = shared
+	return shared
+
+
+def attach(descriptor):
+	"""
+	Attaches to a block shared by another process. Attaching twice to the same block in a process returns the same
+	arrays.
+	:param descriptor: The descriptor of the SharedDataset.
+	:return: The SharedDataset, whose arrays are read only.
+	"""
+	name, layout = descriptor
+	if name in _owned and _owned[name].owner == os.getpid():
+		return _owned[name]
+	if name not in _attached:
+		_attached[name] = SharedDataset(shared_memory.SharedMemory(name=name), layout, False)
+	return _attached[name]
+
+
+@atexit.register
+def close_all():
+	"""
+	Detaches from every block and removes the ones this process owns, so that none outlives the run.
+	:return: None.
+	"""
+	for shared in list(_attached.values()) + list(_owned.values()):
+		shared.close()
@@ -0,0 +1,210 @@
+"""
+A uniform grid index over the locations of the collisions. The coordinates are projected to meters around NYC and
+every collision is filed under the square cell it falls in, so a bounding box or radius query only looks at the
+collisions of the cells it overlaps. The grid covers a fixed bounding box around NYC, so that a stray location such as
+(0, 0) cannot blow it up; collisions outside of it are only counted.
+"""
+import argparse
+import numpy as np
+import aggregate
+import classifier
+
+CELL_SIZE = 100
+LATITUDE_0 = 40.7
+METERS_PER_DEGREE = 111320.
+CLASSES = ['Safe', 'Injured', 'Killed']
+
+
+def project(latitude, longitude):
+	"""
+	Projects coordinates to meters with an equirectangular projection centered on NYC.
+	:param latitude: The array of latitudes.
+	:param longitude: The array of longitudes.
+	:return: The arrays of x and y in meters.
+	"""
+	x = np.asarray(longitude, dtype=np.float64) * METERS_PER_DEGREE * np.cos(np.radians(LATITUDE_0))
+	y = np.asarray(latitude, dtype=np.float64) * METERS_PER_DEGREE
+	return x, y
+
+
+def unproject(x, y):
+	"""
+	Turns projected meters back into coordinates.
+	:param x: The x in meters.
+	:param y: The y in meters.
+	:return: The latitude and longitude.
+	"""
+	return y / METERS_PER_DEGREE, x / (METERS_PER_DEGREE * np.cos(np.radians(LATITUDE_0)))
+
+
+class SpatialGrid:
+	"""
+	Stores the collisions sorted by the grid cell they fall in, with the position of the first collision of every
+	cell. Collisions outside the NYC bounding box are left out of the grid and only counted in outside.
+	"""
+	__slots__ = 'cell_size', 'x0', 'y0', 'rows', 'cols', 'starts', 'rows_of', 'x', 'y', 'classes', 'outside'
+
+	def __init__(self, latitude, longitude, classes, cell_size=CELL_SIZE):
+		x, y = project(latitude, longitude)
+		x_min, y_min = project(aggregate.SOUTH, aggregate.WEST)
+		x_max, y_max = project(aggregate.NORTH, aggregate.EAST)
+		self.cell_size = cell_size
+		self.x0 = float(x_min)
+		self.y0 = float(y_min)
+		self.cols = int((x_max - x_min) // cell_size) + 1
+		self.rows = int((y_max - y_min) // cell_size) + 1
+		inside = np.flatnonzero((x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max))
+		self.outside = len(x) - len(inside)
+		cell = self.cell_of(x[inside], y[inside])
+		order = np.argsort(cell, kind='stable')
+		self.rows_of = inside[order]
+		self.starts = np.searchsorted(cell[order], np.arange(self.rows * self.cols + 1))
+		self.x = x[self.rows_of]
+		self.y = y[self.rows_of]
+		self.classes = np.asarray(classes)[self.rows_of]
+
+	@classmethod
+	def from_file(cls, file_name, cell_size=CELL_SIZE):
+		"""
+		Builds the grid of a classified csv file.
+		:param file_name: The name of the file.
+		:param cell_size: The size of a cell in meters.
+		:return: The grid.
+		"""
+		attrs, data, classes = classifier.load_data(file_name)
+		return cls(data[:, attrs.index('LATITUDE')], data[:, attrs.index('LONGITUDE')], classes, cell_size)
+
+	def cell_of(self, x, y):
+		"""
+		Finds the cell of some projected points.
+		:param x: The array of x in meters.
+		:param y: The array of y in meters.
+		:return: The array of cell numbers.
+		"""
+		col = ((x - self.x0) // self.cell_size).astype(np.intp)
+		row = ((y - self.y0) // self.cell_size).astype(np.intp)
+		return row * self.cols + col
+
+	def candidates(self, x_min, y_min, x_max, y_max):
+		"""
+		Finds the positions of the collisions in every cell that overlaps a box.
+		:param x_min: The west edge in meters.
+		:param y_min: The south edge in meters.
+		:param x_max: The east edge in meters.
+		:param y_max: The north edge in meters.
+		:return: The array of positions in the sorted arrays.
+		"""
+		col_min = max(int((x_min - self.x0) // self.cell_size), 0)
+		col_max = min(int((x_max - self.x0) // self.cell_size), self.cols - 1)
+		row_min = max(int((y_min - self.y0) // self.cell_size), 0)
+		row_max = min(int((y_max - self.y0) // self.cell_size), self.rows - 1)
+		if col_min > col_max or row_min > row_max:
+			return np.empty(0, dtype=np.intp)
+		ranges = [np.arange(self.starts[row * self.cols + col_min], self.starts[row * self.cols + col_max + 1])
+				  for row in range(row_min, row_max + 1)]
+		return np.concatenate(ranges)
+
+	def bbox(self, south, west, north, east, safety_class=None):
+		"""
+		Finds the collisions inside a bounding box.
+		:param south: The smallest latitude.
+		:param west: The smallest longitude.
+		:param north: The largest latitude.
+		:param east: The largest longitude.
+		:param safety_class: Only find collisions of this class. Default value is None, i.e. every class.
+		:return: The array of row numbers of the collisions in the data the grid was built from.
+		"""
+		x_min, y_min = project(south, west)
+		x_max, y_max = project(north, east)
+		found = self.candidates(x_min, y_min, x_max, y_max)
+		x = self.x[found]
+		y = self.y[found]
+		mask = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+		return self.finish(found, mask, safety_class)
+
+	def radius(self, latitude, longitude, meters, safety_class=None):
+		"""
+		Finds the collisions within a distance of a point, e.g. the fatal collisions within 500 m of an intersection.
+		:param latitude: The latitude of the point.
+		:param longitude: The longitude of the point.
+		:param meters: The distance in meters.
+		:param safety_class: Only find collisions of this class. Default value is None, i.e. every class.
+		:return: The array of row numbers of the collisions in the data the grid was built from.
+		"""
+		x, y = project(latitude, longitude)
+		found = self.candidates(x - meters, y - meters, x + meters, y + meters)
+		mask = (self.x[found] - x) ** 2 + (self.y[found] - y) ** 2 <= meters ** 2
+		return self.finish(found, mask, safety_class)
+
+	def finish(self, found, mask, safety_class):
+		"""
+		Turns the positions of the matching collisions into row numbers.
+		:param found: The array of candidate positions.
+		:param mask: The mask of the candidates that match the query.
+		:param safety_class: Only keep collisions of this class, if not None.
+		:return: The sorted array of row numbers.
+		"""
+		if safety_class is not None:
+			mask &= self.classes[found] == safety_class
+		return np.sort(self.rows_of[found[mask]])
+
+	def cell_counts(self):
+		"""
+		Counts the collisions of every class in every cell.
+		:return: An array of shape (rows, cols, classes), row 0 being the southernmost.
+		"""
+		cell = np.repeat(np.arange(self.rows * self.cols), np.diff(self.starts))
+		classes = len(CLASSES)
+		counts = np.bincount(cell * classes + self.classes, minlength=self.rows * self.cols * classes)
+		return counts.reshape(self.rows, self.cols, classes)
+
+	def hotspots(self, n=10, safety_class=None):
+		"""
+		Ranks the cells by the number of collisions in them.
+		:param n: The number of cells to return.
+		:param safety_class: Only count collisions of this class. Default value is None, i.e. every class.
+		:return: A list of (latitude, longitude, count) of the centers of the n busiest cells, leaving out empty ones.
+		"""
+		counts = self.cell_counts()
+		counts = counts.sum(axis=2) if safety_class is None else counts[:, :, safety_class]
+		best = np.argsort(counts, axis=None, kind='stable')[::-1][:n]
+		spots = []
+		for cell in best:
+			row, col = divmod(int(cell), self.cols)
+			if counts[row, col] == 0:
+				break
+			latitude, longitude = unproject(self.x0 + (col + .5) * self.cell_size, self.y0 + (row + .5) * self.cell_size)
+			spots.append((float(latitude), float(longitude), int(counts[row, col])))
+		return spots
+
+
+def parse_args():
+	"""
+	Parses the command line arguments.
+	:return: The arguments.
+	"""
+	parser = argparse.ArgumentParser(description='Finds collisions near a point and the collision hotspots.')
+	parser.add_argument('--input', default='clean_classified.csv', help='The classified collisions file.')
+	parser.add_argument('--cell-size', type=float, default=CELL_SIZE, help='The size of a grid cell in meters.')
+	parser.add_argument('--point', nargs=2, type=float, metavar=('LATITUDE', 'LONGITUDE'),
+						help='Count the collisions near this point.')
+	parser.add_argument('--radius', type=float, default=500, help='The distance from the point in meters.')
+	parser.add_argument('--class', dest='safety_class', type=int, choices=range(len(CLASSES)),
+						help='Only consider collisions of this class.')
+	parser.add_argument('--hotspots', type=int, default=10, help='The number of hotspots to list.')
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	grid = SpatialGrid.from_file(args.input, args.cell_size)
+	if grid.outside > 0:
+		print(grid.outside, 'collisions are outside the NYC bounding box')
+	if args.point is not None:
+		found = grid.radius(args.point[0], args.point[1], args.radius, args.safety_class)
+		print(len(found), 'collisions within', args.radius, 'm')
+	for latitude, longitude, count in grid.hotspots(args.hotspots, args.safety_class):
+		print(round(latitude, 6), round(longitude, 6), count)
+
+if __name__ == '__main__':
+	main()